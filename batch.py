@@ -0,0 +1,399 @@
+"""
+Headless batch cell counting
+
+Example:
+    python -m batch images/ --output counts.csv --peak-thresh-frac 0.35 --min-area 40
+
+Results are appended to the output file (.csv or .jsonl) as each image finishes.
+Re-running with the same output skips images already counted with the same
+parameters, so an interrupted run can simply be started again.
+
+--profile prints time spent per pipeline stage over all images; --trace
+writes the same stages as a Chrome trace (chrome://tracing, Perfetto).
+
+Stacks (multi-page TIFFs) are counted on their first plane, or with
+--projection max/mean on the projection of all planes.
+
+--cells FILE (.csv or .parquet) also writes one row per cell: area,
+centroid, bounding box and mean/integrated intensity of every channel.
+CSV tables are appended to; a .parquet path is a dataset directory that gets
+one part file per run, so rows of earlier runs are never overwritten.
+
+--engine components counts every connected foreground component as one cell,
+much faster, with --min-area/--max-area compared to component areas rather
+than watershed basins, so counts differ. --engine auto uses components only
+for images whose nuclei don't touch and where both engines give the same count
+on a central window, watershed otherwise.
+
+--native-depth thresholds 16-bit images at their own bit depth instead of
+after scaling to 8 bit, which keeps dim fields from collapsing onto a few
+gray levels.
+
+--marker CH[:THRESHOLD] (repeatable) classifies every cell as positive or
+negative for a marker channel by its mean intensity, Otsu over all cells
+without a threshold, and reports the count of every marker combination.
+
+--cache DIR keeps segmentation stages on disk, keyed by image content and
+parameters, so re-counting the same images with a changed min area or region
+only redoes the stages that depend on it.
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff')
+FIELDS = ["path", "count", "peak_thresh_frac", "min_area", "max_area", "channel",
+          "projection", "engine", "native_depth", "markers", "tile_size", "otsu_value",
+          "marker_counts", "seconds", "error"]
+# Values of options that older result files have no column for
+DEFAULT_MAX_AREA = 20000
+DEFAULT_TILE_SIZE = 0
+
+
+def find_images(inputs, recursive=False):
+    """
+    input: directories, files or glob patterns
+    Returns sorted list of image paths
+    """
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, "**", "*") if recursive else os.path.join(item, "*")
+            candidates = glob.glob(pattern, recursive=recursive)
+        else:
+            candidates = glob.glob(item, recursive=True)
+        paths.update(p for p in candidates
+                     if os.path.isfile(p) and os.path.splitext(p)[1].lower() in IMAGE_EXTENSIONS)
+    return sorted(paths)
+
+
+def result_key(path, peak_thresh_frac, min_area, channel, projection=None, engine=None,
+               native_depth=0, markers=None, max_area=None, tile_size=None):
+    """
+    Identifies one image counted with one parameter set
+    Missing values (None, "") mean the defaults, as in rows of older result files
+    """
+    return (os.path.abspath(path), float(peak_thresh_frac), int(min_area), int(channel),
+            projection or "", engine or "watershed", int(native_depth or 0), markers or "",
+            int(max_area or DEFAULT_MAX_AREA), int(tile_size or DEFAULT_TILE_SIZE))
+
+
+def args_result_key(path, args):
+    """result_key of path counted with parsed count arguments"""
+    return result_key(path, args.peak_thresh_frac, args.min_area, args.channel,
+                      args.projection, args.engine, args.native_depth,
+                      marker_spec(dict(args.marker)), args.max_area, args.tile_size)
+
+
+def read_done(output):
+    """
+    Returns keys of successfully counted images already in output
+    """
+    done = set()
+    if not os.path.exists(output):
+        return done
+
+    with open(output, newline="") as f:
+        if output.endswith(".jsonl"):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for row in rows:
+            if row.get("error"):
+                continue
+            done.add(result_key(row["path"], row["peak_thresh_frac"],
+                                row["min_area"], row["channel"], row.get("projection"),
+                                row.get("engine"), row.get("native_depth"),
+                                row.get("markers"), row.get("max_area"),
+                                row.get("tile_size")))
+    return done
+
+
+class ResultWriter:
+    def __init__(self, output):
+        """
+        Appends result rows to a .csv or .jsonl file, flushing after each row
+        Existing CSV files missing some of FIELDS are rewritten once with those
+        columns added (empty in old rows, read back as the option defaults)
+        """
+        self.jsonl = output.endswith(".jsonl")
+        new_file = not os.path.exists(output) or os.path.getsize(output) == 0
+        fieldnames = FIELDS
+        if not new_file and not self.jsonl:
+            with open(output, newline="") as f:
+                reader = csv.DictReader(f)
+                fieldnames = reader.fieldnames or FIELDS
+                missing = [name for name in FIELDS if name not in fieldnames]
+                rows = list(reader) if missing else None
+            if missing:
+                fieldnames = fieldnames + missing
+                tmp = output + ".tmp"
+                with open(tmp, "w", newline="") as f:
+                    writer = csv.DictWriter(f, fieldnames=fieldnames)
+                    writer.writeheader()
+                    writer.writerows(rows)
+                os.replace(tmp, output)
+        self.file = open(output, "a", newline="")
+        if not self.jsonl:
+            self.writer = csv.DictWriter(self.file, fieldnames=fieldnames, extrasaction="ignore")
+            if new_file:
+                self.writer.writeheader()
+
+    def write(self, row):
+        if self.jsonl:
+            self.file.write(json.dumps(row) + "\n")
+        else:
+            self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_marker(text):
+    """Parses a --marker value, "CH" or "CH:THRESHOLD", into (channel, threshold or None)"""
+    channel, _, threshold = text.partition(":")
+    try:
+        return int(channel), float(threshold) if threshold else None
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected CH or CH:THRESHOLD, got {text!r}")
+
+
+def marker_spec(markers):
+    """Returns markers {channel: threshold or None} as text, e.g. "0:auto,1:40" """
+    return ",".join(f"{c}:{'auto' if t is None else f'{t:g}'}" for c, t in sorted(markers.items()))
+
+
+def _init_worker():
+    # One process per core already; stop OpenCV from oversubscribing threads
+    import cv2 as cv
+    cv.setNumThreads(1)
+
+
+def count_image(job):
+    """
+    Worker: loads one image and counts cells
+    Returns result row; errors are reported in the row instead of raised
+    """
+    from imagehandling import ImageHandling
+    from cellcount import CellCount
+    from tiledcount import TiledCellCount
+    from profiling import StageProfiler
+    from resultcache import ResultCache
+
+    path, params = job
+    row = {"path": os.path.abspath(path),
+           "count": None,
+           "peak_thresh_frac": params["peak_thresh_frac"],
+           "min_area": params["min_area"],
+           "max_area": params["max_area"],
+           "channel": params["channel"],
+           "projection": params["projection"] or "",
+           "engine": params["engine"],
+           "native_depth": int(params["native_depth"]),
+           "markers": marker_spec(params["markers"]) if params["markers"] else "",
+           "tile_size": params["tile_size"],
+           "otsu_value": None,
+           "marker_counts": "",
+           "seconds": None,
+           "error": ""}
+    analysis = None
+    start = time.perf_counter()
+    try:
+        images = ImageHandling()
+        if not images.load_path(path, lazy=True, projection=params["projection"]):
+            raise ValueError("Could not load image file")
+        run_args = dict(channel=params["channel"], max_area=params["max_area"])
+
+        if params["tile_size"]:
+            analysis = TiledCellCount(images.loaded_image, params["peak_thresh_frac"],
+                                      params["min_area"], tile_size=params["tile_size"],
+                                      processes=1)
+        else:
+            analysis = CellCount(images.loaded_image, params["peak_thresh_frac"],
+                                 params["min_area"])
+            analysis.engine = params["engine"]
+            analysis.native_depth = params["native_depth"]
+            analysis.markers = params["markers"]
+            run_args["outputs"] = ()  # count only: no overlay, centroids or debug images
+            if params["cells"]:
+                run_args["outputs"] += ("measurements",)
+            if params["markers"]:
+                run_args["outputs"] += ("colocalization",)
+            if params["cache"]:
+                analysis.disk_cache = ResultCache(params["cache"], params["cache_size"])
+        if params["profile"]:
+            analysis.profiler = StageProfiler(memory=params["profile_memory"])
+        count, _, debug = analysis.run(**run_args)
+
+        row["count"] = count
+        row["otsu_value"] = float(debug["otsu_value"])
+        if params["markers"]:
+            counts = debug["colocalization"]["counts"]
+            row["marker_counts"] = "; ".join(f"{combo}: {n}" for combo, n in counts.items())
+        if params["cells"]:
+            # Cell table travels back with the row; written to its own file
+            row["cells"] = debug["measurements"]
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+    row["seconds"] = round(time.perf_counter() - start, 3)
+    if params["profile"]:
+        # Stage events travel back with the row; not written to the output
+        row["events"] = analysis.profiler.events if analysis is not None else []
+    return row
+
+
+def add_count_arguments(parser):
+    """Adds the counting and output options shared with watch"""
+    parser.add_argument("-o", "--output", required=True, help="results file (.csv or .jsonl)")
+    parser.add_argument("--peak-thresh-frac", type=float, default=0.35)
+    parser.add_argument("--min-area", type=int, default=40)
+    parser.add_argument("--max-area", type=int, default=DEFAULT_MAX_AREA)
+    parser.add_argument("--channel", type=int, default=2)
+    parser.add_argument("--projection", choices=("max", "mean"),
+                        help="count the intensity projection of stacks (default: first plane)")
+    parser.add_argument("--engine", choices=("watershed", "components", "auto"),
+                        default="watershed",
+                        help="split touching nuclei (watershed), count connected components "
+                             "(components, faster) or choose per image (auto)")
+    parser.add_argument("--native-depth", action="store_true",
+                        help="blur and threshold 16-bit images without scaling them to 8 bit")
+    parser.add_argument("--marker", action="append", type=parse_marker, default=[],
+                        metavar="CH[:THRESHOLD]",
+                        help="marker channel to classify cells by (repeatable); without a "
+                             "threshold, Otsu over the cells' mean intensities is used")
+    parser.add_argument("--tile-size", type=int, default=DEFAULT_TILE_SIZE,
+                        help="count large images tile by tile (0 = whole image)")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+                        help="worker processes (default: one per core)")
+    parser.add_argument("-r", "--recursive", action="store_true",
+                        help="search directories recursively")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="count all images even if already in output")
+    parser.add_argument("--cells", help="also write per-cell measurements to this .csv file "
+                                        "or .parquet dataset directory")
+    parser.add_argument("--cache", help="directory keeping segmentation stages between runs")
+    parser.add_argument("--cache-size", type=float, default=2048,
+                        help="cache size limit in MB, least recently used stages are removed")
+    parser.add_argument("--profile", action="store_true",
+                        help="print time spent per pipeline stage")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="also trace bytes allocated per stage (slower)")
+    parser.add_argument("--trace", help="write pipeline stages to this Chrome trace JSON file")
+
+
+def check_args(args):
+    """Returns why the parsed count arguments can't be combined, None if they can"""
+    if args.cells and args.tile_size:
+        return "--cells is not supported with --tile-size"
+    if (args.engine != "watershed" or args.native_depth or args.marker) and args.tile_size:
+        return "--engine, --native-depth and --marker are not supported with --tile-size"
+    return None
+
+
+def count_params(args):
+    """Returns the params dict count_image expects from parsed count arguments"""
+    return {"peak_thresh_frac": args.peak_thresh_frac,
+            "min_area": args.min_area,
+            "max_area": args.max_area,
+            "channel": args.channel,
+            "projection": args.projection,
+            "engine": args.engine,
+            "native_depth": args.native_depth,
+            "markers": dict(args.marker) or None,
+            "tile_size": args.tile_size,
+            "cells": args.cells,
+            "cache": args.cache,
+            "cache_size": int(args.cache_size * 2**20),
+            "profile": bool(args.profile or args.profile_memory or args.trace),
+            "profile_memory": args.profile_memory}
+
+
+def open_writers(args):
+    """Returns ResultWriter and CellTableWriter (None without --cells)"""
+    writer = ResultWriter(args.output)
+    cell_writer = None
+    if args.cells:
+        from measurements import CellTableWriter
+        cell_writer = CellTableWriter(args.cells)
+    return writer, cell_writer
+
+
+def store_row(row, writer, cell_writer, events):
+    """
+    Writes a finished row (and its cell table) and collects its stage events
+    Returns True if the image failed
+    """
+    events.extend(row.pop("events", ()))
+    cells = row.pop("cells", None)
+    if cell_writer is not None and cells is not None:
+        try:
+            cell_writer.write(cells, path=row["path"])
+        except ValueError as e:  # e.g. other channel count than earlier images
+            row["error"] = f"{type(e).__name__}: {e}"
+    writer.write(row)
+    return bool(row["error"])
+
+
+def report_profile(args, events):
+    """Prints stage summary and writes Chrome trace as requested"""
+    from profiling import StageProfiler
+    profiler = StageProfiler()
+    if args.profile or args.profile_memory:
+        print(profiler.format_summary(events), file=sys.stderr)
+    if args.trace:
+        profiler.save_chrome_trace(args.trace, events)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Count cells in many images without the GUI")
+    parser.add_argument("inputs", nargs="+", help="image directories, files or glob patterns")
+    add_count_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    error = check_args(args)
+    if error:
+        print(error, file=sys.stderr)
+        return 2
+    params = count_params(args)
+
+    paths = find_images(args.inputs, args.recursive)
+    done = set() if args.no_resume else read_done(args.output)
+    todo = [p for p in paths
+            if args_result_key(p, args) not in done]
+    print(f"{len(paths)} images, {len(paths) - len(todo)} already counted, {len(todo)} to do",
+          file=sys.stderr)
+    if not todo:
+        return 0
+
+    writer, cell_writer = open_writers(args)
+    failed = 0
+    events = []
+    try:
+        with Pool(args.processes, initializer=_init_worker) as pool:
+            jobs = ((p, params) for p in todo)
+            for i, row in enumerate(pool.imap_unordered(count_image, jobs), 1):
+                failed += store_row(row, writer, cell_writer, events)
+                status = row["error"] or row["count"]
+                print(f"[{i}/{len(todo)}] {row['path']}: {status}", file=sys.stderr)
+    finally:
+        writer.close()
+        if cell_writer is not None:
+            cell_writer.close()
+
+    if params["profile"]:
+        report_profile(args, events)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
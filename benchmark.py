@@ -0,0 +1,246 @@
+"""
+Synthetic nuclei benchmark for CellCount
+
+Generates reproducible fluorescence fields with known nuclei and reports per
+stage timings, throughput, peak memory and count error against ground truth.
+
+Example:
+    python -m benchmark --sizes 512 1024 2048 --densities 1 3 --save-baseline bench.json
+    python -m benchmark --sizes 512 1024 2048 --densities 1 3 --compare bench.json
+    python -m benchmark --sizes 2048 --cluster-fracs 0 0.3 --engines watershed components auto
+"""
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2 as cv
+import numpy as np
+
+from cellcount import CellCount
+from profiling import StageProfiler
+
+
+def synthetic_field(h,
+                    w,
+                    density=2.0,
+                    seed=0,
+                    bit_depth=8,
+                    channels=3,
+                    radius=(4, 10),
+                    cluster_frac=0.3,
+                    noise=0.05):
+    """
+    Returns (image, ground truth label image, number of nuclei)
+    density: nuclei per 100 x 100 px
+    cluster_frac: fraction of nuclei placed touching/overlapping a previous one
+    noise: gaussian noise sigma as a fraction of the intensity range
+    Nuclei are drawn into channel 2 (or the only channel); channels 0 and 1
+    hold unrelated cytoplasm-like signal
+    """
+    rng = np.random.default_rng(seed)
+    n = int(round(density * h * w / 10000))
+    nuclei = np.zeros((h, w), dtype=np.float32)
+    truth = np.zeros((h, w), dtype=np.int32)
+
+    centers = []
+    for i in range(1, n + 1):
+        a = int(rng.integers(radius[0], radius[1] + 1))
+        b = int(max(radius[0] - 1, a * rng.uniform(0.6, 1.0)))
+        if centers and rng.random() < cluster_frac:
+            # Touching or slightly overlapping a previous nucleus
+            px, py, pr = centers[rng.integers(len(centers))]
+            angle = rng.uniform(0, 2 * np.pi)
+            dist = (pr + a) * rng.uniform(0.75, 1.0)
+            x, y = int(px + dist * np.cos(angle)), int(py + dist * np.sin(angle))
+        else:
+            x, y = int(rng.integers(0, w)), int(rng.integers(0, h))
+        centers.append((x, y, a))
+        axes = (a, b)
+        rot = float(rng.uniform(0, 180))
+        cv.ellipse(nuclei, (x, y), axes, rot, 0, 360, float(rng.uniform(0.5, 1.0)), -1)
+        cv.ellipse(truth, (x, y), axes, rot, 0, 360, i, -1)
+
+    # Optics blur, background and noise
+    nuclei = cv.GaussianBlur(nuclei, (0, 0), 1.2)
+    nuclei += 0.05 + rng.normal(0, noise, nuclei.shape).astype(np.float32)
+
+    max_value = 255 if bit_depth == 8 else (1 << bit_depth) - 1
+    dtype = np.uint8 if bit_depth == 8 else np.uint16
+
+    def to_dtype(chan):
+        return np.clip(chan * max_value, 0, max_value).astype(dtype)
+
+    if channels == 1:
+        return to_dtype(nuclei), truth, n
+
+    other = [cv.GaussianBlur(rng.random((h, w), dtype=np.float32), (0, 0), 8) * 0.6
+             for _ in range(2)]
+    img = np.dstack([to_dtype(other[0]), to_dtype(other[1]), to_dtype(nuclei)])
+    return img, truth, n
+
+
+def detection_scores(centroids, truth, n_true):
+    """
+    A detection is a hit if its centroid lies on a true nucleus not hit before
+    Returns (precision, recall)
+    """
+    if len(centroids) == 0:
+        return 0.0, 0.0
+    xs = np.clip(centroids[:, 0].astype(np.intp), 0, truth.shape[1] - 1)
+    ys = np.clip(centroids[:, 1].astype(np.intp), 0, truth.shape[0] - 1)
+    labels = truth[ys, xs]
+    hits = len(np.unique(labels[labels > 0]))
+    return hits / len(centroids), hits / max(n_true, 1)
+
+
+def run_case(size, density, bit_depth, channels, peak_thresh_frac, min_area, repeat, seed,
+             engine="watershed", cluster_frac=0.3, native_depth=False):
+    """
+    Benchmarks one synthetic field
+    Returns result dict
+    """
+    img, truth, n_true = synthetic_field(size, size, density, seed=seed,
+                                         bit_depth=bit_depth, channels=channels,
+                                         cluster_frac=cluster_frac)
+    best = None
+    for _ in range(repeat):
+        analysis = CellCount(img, peak_thresh_frac, min_area)
+        analysis.engine = engine
+        analysis.native_depth = native_depth
+        analysis.profiler = StageProfiler()
+        tracemalloc.start()
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        count, _, debug = analysis.run(channel=2 if channels == 3 else 0,
+                                       outputs=("centroids",))
+        wall = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if best is None or wall < best["seconds"]:
+            best = {"seconds": wall, "cpu_seconds": cpu, "peak_mb": peak / 2**20,
+                    "stages": {k: v["wall"] for k, v in analysis.profiler.summary().items()},
+                    "count": count,
+                    "engine": debug["engine"],
+                    "centroids": debug["centroids"]}
+
+    precision, recall = detection_scores(best.pop("centroids"), truth, n_true)
+    megapixels = size * size / 1e6
+    # Default engine and clustering keep the case names of older baselines
+    case = f"{size}px_d{density:g}_{bit_depth}bit_{channels}ch"
+    if cluster_frac != 0.3:
+        case += f"_c{cluster_frac:g}"
+    if engine != "watershed":
+        case += f"_{engine}"
+    if native_depth and bit_depth > 8:
+        case += "_native"
+    return {
+        "case": case,
+        "size": size,
+        "density": density,
+        "bit_depth": bit_depth,
+        "channels": channels,
+        "engine": best["engine"],
+        "true_count": n_true,
+        "count": best["count"],
+        "count_error": (best["count"] - n_true) / max(n_true, 1),
+        "precision": precision,
+        "recall": recall,
+        "seconds": best["seconds"],
+        "cpu_seconds": best["cpu_seconds"],
+        "megapixels_per_s": megapixels / best["seconds"],
+        "peak_mb": best["peak_mb"],
+        "stages": {k: round(v, 6) for k, v in best["stages"].items()}
+    }
+
+
+def compare(results, baseline, time_tolerance, error_tolerance):
+    """
+    Returns list of regression messages against a baseline results list
+    """
+    base = {r["case"]: r for r in baseline["results"]}
+    problems = []
+    for r in results:
+        b = base.get(r["case"])
+        if b is None:
+            continue
+        if r["seconds"] > b["seconds"] * (1 + time_tolerance):
+            problems.append(f"{r['case']}: {r['seconds']:.3f}s vs baseline {b['seconds']:.3f}s")
+        if abs(r["count_error"]) > abs(b["count_error"]) + error_tolerance:
+            problems.append(f"{r['case']}: count error {r['count_error']:+.3f} "
+                            f"vs baseline {b['count_error']:+.3f}")
+    return problems
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark CellCount on synthetic nuclei")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048])
+    parser.add_argument("--densities", type=float, nargs="+", default=[1.0, 3.0],
+                        help="nuclei per 100 x 100 px")
+    parser.add_argument("--bit-depths", type=int, nargs="+", default=[8], choices=[8, 12, 16])
+    parser.add_argument("--channels", type=int, nargs="+", default=[3], choices=[1, 3])
+    parser.add_argument("--cluster-fracs", type=float, nargs="+", default=[0.3],
+                        help="fraction of nuclei touching a previous one")
+    parser.add_argument("--engines", nargs="+", default=["watershed"],
+                        choices=["watershed", "components", "auto"])
+    parser.add_argument("--native-depth", action="store_true",
+                        help="threshold 12/16-bit fields at their own bit depth")
+    parser.add_argument("--peak-thresh-frac", type=float, default=0.35)
+    parser.add_argument("--min-area", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, best is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", help="write results to this JSON file")
+    parser.add_argument("--compare", help="compare against this baseline JSON file")
+    parser.add_argument("--time-tolerance", type=float, default=0.25,
+                        help="allowed relative slowdown before reporting a regression")
+    parser.add_argument("--error-tolerance", type=float, default=0.01,
+                        help="allowed increase in relative count error")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    header = f"{'case':<40}{'true':>8}{'count':>8}{'err':>8}{'recall':>8}{'sec':>9}{'MP/s':>8}{'MB':>9}"
+    print(header)
+    for size in args.sizes:
+        for density in args.densities:
+            for bit_depth, channels, cluster_frac, engine in itertools.product(
+                    args.bit_depths, args.channels, args.cluster_fracs, args.engines):
+                r = run_case(size, density, bit_depth, channels, args.peak_thresh_frac,
+                             args.min_area, args.repeat, args.seed, engine, cluster_frac,
+                             args.native_depth)
+                results.append(r)
+                print(f"{r['case']:<40}{r['true_count']:>8}{r['count']:>8}"
+                      f"{r['count_error']:>+8.3f}{r['recall']:>8.3f}{r['seconds']:>9.3f}"
+                      f"{r['megapixels_per_s']:>8.2f}{r['peak_mb']:>9.1f}")
+                slowest = sorted(r["stages"].items(), key=lambda kv: -kv[1])[:3]
+                print("    " + ", ".join(f"{k} {v:.3f}s" for k, v in slowest))
+
+    report = {"python": platform.python_version(),
+              "numpy": np.__version__,
+              "opencv": cv.__version__,
+              "machine": platform.machine(),
+              "parameters": {"peak_thresh_frac": args.peak_thresh_frac,
+                             "min_area": args.min_area},
+              "results": results}
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            problems = compare(results, json.load(f), args.time_tolerance, args.error_tolerance)
+        for p in problems:
+            print("REGRESSION " + p)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,181 @@
 import cv2 as cv
 import numpy as np
 
+from measurements import label_blocks, label_means, measure_cells
+
+
+def label_centroids(labels, ids):
+    """
+    input: label image, label ids
+    Returns area and centroid (cx, cy) of every id in a single pass over the image,
+    matching the values cv.moments gives for each label mask
+    Rows are reduced in blocks (label_blocks) so temporaries stay small
+    """
+    # Repeated ids get the same values
+    unique, inverse = np.unique(np.asarray(ids, dtype=np.int64), return_inverse=True)
+    n = len(unique)
+    w = labels.shape[1]
+    m00 = np.zeros(n, dtype=np.int64)
+    m10 = np.zeros(n)
+    m01 = np.zeros(n)
+
+    for y0, _, pos, rows in label_blocks(labels, unique):
+        ys, xs = np.divmod(pos, w)
+        # Sums of integer coordinates are exact, so blocking doesn't change them
+        m00 += np.bincount(rows, minlength=n)
+        m10 += np.bincount(rows, weights=xs, minlength=n)
+        m01 += np.bincount(rows, weights=ys + y0, minlength=n)
+
+    area = m00[inverse]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cx = np.where(area > 0, m10[inverse] / area, 0)
+        cy = np.where(area > 0, m01[inverse] / area, 0)
+    return area, cx, cy
+
+
+def component_argmax(cc_labels, num_cc, values):
+    """
+    input: component label image, number of labels, value image
+    Returns flat index of the first (row-major) maximum of values in each
+    component, the pixel np.argmax would pick on the component alone
+    """
+    fg = np.flatnonzero(cc_labels)
+    fg_labels = cc_labels.ravel()[fg]
+    fg_values = values.ravel()[fg]
+    comp_max = np.zeros(num_cc, dtype=values.dtype)
+    np.maximum.at(comp_max, fg_labels, fg_values)
+    at_max = fg_values == comp_max[fg_labels]
+    max_labels, first = np.unique(fg_labels[at_max], return_index=True)
+    argmax = np.zeros(num_cc, dtype=np.intp)
+    argmax[max_labels] = fg[at_max][first]
+    return argmax
+
+
+def otsu_threshold(hist):
+    """
+    input: histogram with one bin per value (256 for 8 bit, 65536 for 16 bit)
+    Returns Otsu threshold computed the way cv.THRESH_OTSU does, so histograms
+    summed over tiles give the threshold of the whole image
+    """
+    hist = np.asarray(hist, dtype=np.float64)
+    total = hist.sum()
+    if total == 0:
+        return 0.0
+    p = hist / total
+    i = np.arange(len(p), dtype=np.float64)
+    q1 = np.cumsum(p)
+    q2 = 1.0 - q1
+    mu = np.dot(i, p)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mu1 = np.cumsum(i * p) / q1
+        mu2 = (mu - q1 * mu1) / q2
+        sigma = q1 * q2 * (mu1 - mu2) ** 2
+    eps = np.finfo(np.float32).eps
+    valid = (np.minimum(q1, q2) >= eps) & (np.maximum(q1, q2) <= 1.0 - eps)
+    sigma = np.where(valid, sigma, 0.0)
+    return float(np.argmax(sigma))
+
+
+def touching_fraction(areas, radii, min_area, clump_ratio=None):
+    """
+    input: area of every connected component (0 = background) and its largest
+    inscribed radius, the maximum of the distance transform inside it
+    Returns fraction of components of at least min_area pixels that look like
+    touching nuclei: more than clump_ratio times the area of their inscribed
+    circle. Round and moderately elongated nuclei stay below, merged ones don't
+    """
+    if clump_ratio is None:
+        clump_ratio = CLUMP_RATIO
+    areas = np.asarray(areas)[1:]
+    radii = np.asarray(radii, dtype=np.float64)[1:]
+    objects = areas >= min_area
+    if not objects.any():
+        return 0.0
+    clumps = areas[objects] > clump_ratio * np.pi * radii[objects] ** 2
+    return float(np.count_nonzero(clumps)) / np.count_nonzero(objects)
+
+
+def cell_otsu_threshold(values, bins: int = 256):
+    """
+    Returns Otsu threshold of per-cell values (e.g. mean marker intensities)
+    from a histogram of bins equal steps between their minimum and maximum;
+    values above it are the positive class
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        return 0.0
+    lo, hi = values.min(), values.max()
+    if hi <= lo:
+        return float(hi)
+    hist, edges = np.histogram(values, bins=bins, range=(lo, hi))
+    return float(edges[int(otsu_threshold(hist)) + 1])
+
+
+def marker_combinations(positive, channels):
+    """
+    input: (N, K) boolean array, whether each of N cells is positive for each
+    of K marker channels
+    Returns {"ch0- ch1+": count, ...} for every combination of markers,
+    all negative first
+    """
+    k = len(channels)
+    code = positive.astype(np.intp) @ (1 << np.arange(k, dtype=np.intp))
+    counts = np.bincount(code, minlength=1 << k)
+    return {" ".join(f"ch{c}{'+' if combo >> i & 1 else '-'}" for i, c in enumerate(channels)):
+            int(counts[combo]) for combo in range(1 << k)}
+
+
+class LazyStages(dict):
+    """
+    Stage results produced on first access: each name maps to a loader that
+    returns its value (or a tuple of values for every name it produces)
+    """
+    def __init__(self):
+        super().__init__()
+        self._loaders = {}
+
+    def defer(self, names, load):
+        for name in names:
+            self._loaders[name] = (names, load)
+
+    def __missing__(self, name):
+        names, load = self._loaders[name]
+        values = load()
+        if len(names) == 1:
+            values = (values,)
+        for n, value in zip(names, values):
+            self[n] = value
+            self._loaders.pop(n, None)
+        return self[name]
+
+
+# Intermediate images run() can return in its debug dict
+DEBUG_STAGES = ("nuclei_norm", "blur", "binary", "dist", "seeds", "markers_ws")
+# Everything run() can build; its default
+ALL_OUTPUTS = ("overlay", "labels", "centroids") + DEBUG_STAGES
+# Built only when asked for: per-cell table, see measurements.measure_cells, and
+# marker positivity per cell, see CellCount.markers
+EXTRA_OUTPUTS = ("measurements", "colocalization")
+# Stages stored in CellCount.disk_cache; normalize and overlay are cheaper to
+# rebuild than to load
+DISK_STAGES = ("threshold", "distance", "connected", "component_max", "touching", "maxima",
+               "seeds", "parity", "watershed", "filter", "centroids", "select")
+# Segmentation engines, see CellCount.engine
+ENGINES = ("watershed", "components", "auto")
+# Area over inscribed circle area above which a component counts as touching
+# nuclei; an ellipse with axes 1 : 0.6 has 1.67, two overlapping disks about 1.9
+CLUMP_RATIO = 1.8
+# Side of the central window both engines are run on before "auto" uses components
+AUTO_PROBE_SIDE = 1024
+
+
+def scale_ksize(ksize, scale, minimum):
+    """
+    Scales a kernel size to a downsampled image, keeping it odd and >= minimum
+    """
+    ksize = max(minimum, int(round(ksize * scale)))
+    return ksize if ksize % 2 == 1 else ksize + 1
+
 
 class CellCount:
     def __init__(self,
@@ -12,114 +187,670 @@ class CellCount:
         self.peak_thresh_frac = peak_thresh_frac
         self.min_area = min_area
 
+        # --- Stage cache: stage name -> (key, result) ---
+        self._cache = {}
+        self._cache_img = None
+
+        # --- Working buffers reused by runs on images of the same size ---
+        # Never returned to callers: name -> array
+        self._buffers = {}
+
+        # --- Downsampled proxies for previews: max_side -> (scale, CellCount) ---
+        self._proxies = {}
+
+        # --- Fixed image statistics, None = computed from self.img ---
+        # Set by tiled runs so every tile is normalized and thresholded alike
+        self.norm_range = None  # (min, max) of the nuclei channel
+        self.otsu_value = None  # threshold on the normalized, blurred image
+        self.dist_max = None    # maximum of the distance transform
+
+        # --- Native bit depth ---
+        # True = 16-bit images are blurred and thresholded as they are, with
+        # Otsu on their full histogram, instead of after scaling to 8 bit; the
+        # 8-bit nuclei_norm is then only built for watershed and overlay
+        # otsu_value is in image units for such images
+        self.native_depth = False
+
+        # --- Counting region ---
+        # Polygon [(x, y), ...] from MaskGenerator, None = whole image. The image
+        # is segmented once; changing the region only re-selects cells
+        self.region = None
+        self.region_select = "centroid"  # or "overlap": at least half the cell inside
+        # Band polygons [[(x, y), ...], ...] from MaskGenerator.bands, None = no
+        # bands. Every cell is assigned to the band its centroid lies in, so
+        # per-band counts come from the same segmentation
+        self.bands = None
+        # Polylines {name: [(x, y), ...]} whose distance to every cell is measured,
+        # e.g. the start and stop curves of the region
+        self.curves = None
+
+        # --- Marker channels for colocalization ---
+        # {channel: threshold}; a cell is positive for a marker if its mean
+        # intensity in that channel is above the threshold, None = Otsu
+        # threshold over the mean intensities of all cells
+        # None = every channel but the nuclei channel, with Otsu thresholds
+        self.markers = None
+
+        # --- Segmentation engine ---
+        # "watershed": seeds from distance peaks split touching nuclei
+        # "components": every connected foreground component is one cell; much
+        #   faster. min_area and max_area apply to the Otsu component, which is
+        #   larger than the watershed basin of the same nucleus, so counts can
+        #   differ from watershed even where nuclei don't touch
+        # "auto": components if at most auto_touching of the components look
+        #   like touching nuclei (touching_fraction) and both engines give the
+        #   same count on the central AUTO_PROBE_SIDE window, watershed otherwise
+        self.engine = "watershed"
+        self.auto_touching = 0.05
+
+        # --- Processing box (x0, y0, x1, y1), None = whole image ---
+        # Only this part of the image is read and segmented; region and reported
+        # centroids stay in full image coordinates
+        self.roi = None
+
+        # --- Stage instrumentation: profiling.StageProfiler, None = off ---
+        self.profiler = None
+
+        # --- Persistent stage cache: resultcache.ResultCache, None = memory only ---
+        self.disk_cache = None
+        self._img_digest = None
+
+    def _cached(self, stage, key, compute, inputs=None):
+        """
+        Returns the cached result of a pipeline stage if its key is unchanged,
+        otherwise fetches it from disk_cache or runs compute(*inputs()) and
+        stores the result under the new key
+        inputs are only resolved on a miss, so a hit never runs upstream stages
+        """
+        hit = self._cache.get(stage)
+        if hit is not None and hit[0] == key:
+            return hit[1]
+
+        result = None
+        disk_key = None
+        if self.disk_cache is not None and stage in DISK_STAGES:
+            if self._img_digest is None:
+                from resultcache import image_digest
+                self._img_digest = image_digest(self.img)
+            disk_key = (self._img_digest, stage, key)
+            if self.profiler is None:
+                result = self.disk_cache.get(disk_key)
+            else:
+                result = self.profiler.measure(stage + ":disk", lambda: self.disk_cache.get(disk_key))
+
+        if result is None:
+            args = () if inputs is None else inputs()
+            if self.profiler is None:
+                result = compute(*args)
+            else:
+                result = self.profiler.measure(stage, lambda: compute(*args))
+            if disk_key is not None:
+                self.disk_cache.put(disk_key, result)
+        self._cache[stage] = (key, result)
+        return result
+
+    def _buffer(self, name, shape, dtype):
+        """
+        Returns the working array stored under name, reallocated only when
+        shape or dtype change; contents are whatever the last user left
+        """
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buf
+        return buf
+
+    def _roi_offset(self):
+        """Returns (x, y) of the processing box in the full image"""
+        return (0, 0) if self.roi is None else (self.roi[0], self.roi[1])
+
+    def _roi_region(self):
+        """Returns region polygon in processing box coordinates, or None"""
+        if self.region is None:
+            return None
+        return np.asarray(self.region).reshape(-1, 2) - self._roi_offset()
+
+    def _roi_bands(self):
+        """Returns band polygons in processing box coordinates, or None"""
+        if self.bands is None:
+            return None
+        return [np.asarray(band).reshape(-1, 2) - self._roi_offset() for band in self.bands]
+
+    def _roi_image(self, channel=None):
+        """
+        Returns the processing box of self.img (the nuclei channel only if given)
+        Lazy images are indexed in one go so only the box is read
+        """
+        img = self.img
+        if self.roi is None:
+            ys = xs = slice(None)
+        else:
+            x0, y0, x1, y1 = self.roi
+            ys, xs = slice(y0, y1), slice(x0, x1)
+
+        if img.ndim == 2:
+            return np.asarray(img[ys, xs])
+        elif img.ndim == 3 and img.shape[2] == 3:
+            return img[ys, xs] if channel is None else img[ys, xs, channel]
+        raise ValueError(f"Unsupported image shape: {img.shape}")
+
+    def clear_cache(self):
+        """Drops all cached pipeline stages held in memory"""
+        self._cache.clear()
+        self._cache_img = None
+        self._img_digest = None
+        self._proxies.clear()
+
     def run(self,
-            channel: int = 2,  
+            channel: int = 2,
             max_area: int = 20000,
             blur_ksize: int = 3,
             maxima_ksize: int = 7,
             dilate_iters: int = 2,
-            do_seed_supplement: bool = True):
+            do_seed_supplement: bool = True,
+            outputs=ALL_OUTPUTS):
+        """
+        outputs: which results to build besides the count, any of ALL_OUTPUTS
+        ("overlay", "labels", "centroids" and the DEBUG_STAGES images) and
+        "measurements" (dict of per-cell columns) and "colocalization" (dict of
+        marker channels, thresholds, per-cell means and positivity and the
+        count of every marker combination); () counts only
+        Returns count, overlay (None unless requested) and a debug dict holding
+        otsu_value, engine (the one used, also when self.engine is "auto") and
+        the requested entries
+        """
+        outputs = set(outputs)
+        unknown = outputs.difference(ALL_OUTPUTS + EXTRA_OUTPUTS)
+        if unknown:
+            raise ValueError(f"Unknown outputs: {sorted(unknown)}")
 
-        img = self.img
-        if img.ndim == 2:
-            nuclei = img
-        elif img.ndim == 3 and img.shape[2] == 3:
-            nuclei = img[:, :, channel]
+        stages, key = self._segment(channel, max_area, blur_ksize, maxima_ksize,
+                                    dilate_iters, do_seed_supplement)
+        kept = stages["kept"]
+
+        # Centroids are only needed to place numbers, report them, select by
+        # region or assign bands
+        if self.region is None and self.bands is None and not outputs & {"overlay", "centroids"}:
+            selected = np.ones(len(kept), dtype=bool)
         else:
-            raise ValueError(f"Unsupported image shape: {img.shape}")
+            areas, cx, cy = stages["cell_areas"], stages["cx"], stages["cy"]
+            region = None if self.region is None else tuple(map(tuple, np.asarray(self.region).tolist()))
+            key = key + (region, self.region_select)
+            selected = self._cached("select", key,
+                                    lambda: self._select(stages["markers_ws"], kept, areas, cx, cy))
 
-        # --- Normalize ---
-        nuclei_norm = cv.normalize(nuclei, None, 0, 255, cv.NORM_MINMAX).astype(np.uint8)
+        vis_numbers = None
+        if "overlay" in outputs:
+            vis_numbers = self._cached("overlay", key,
+                                       lambda: self._overlay(stages["nuclei_norm"],
+                                                             cx[selected], cy[selected]))
 
-        # --- Gentle blur ---
+        debug = {"otsu_value": stages["otsu_value"], "engine": stages["engine"]}
+        cell_band = None
+        if self.bands is not None:
+            bands = tuple(tuple(map(tuple, np.asarray(b).reshape(-1, 2).tolist())) for b in self.bands)
+            shape = stages["markers_ws"].shape
+            raster, box, band_areas = self._cached(
+                "band_raster", (self._roi_offset(), shape, bands),
+                lambda: self._band_raster(shape))
+            cell_band = self._cached("bands", key + (bands,),
+                                     lambda: self._assign_bands(raster, box, cx, cy))
+            counts = np.bincount(cell_band[selected], minlength=len(bands) + 1)[1:]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                density = np.where(band_areas > 0, counts / band_areas, 0.0)
+            debug["bands"] = {"counts": counts, "areas": band_areas, "density": density}
+        for name in DEBUG_STAGES:
+            if name in outputs:
+                debug[name] = stages[name]
+        if "labels" in outputs:
+            debug["labels"] = kept[selected]
+        if "centroids" in outputs:
+            debug["centroids"] = np.column_stack((cx[selected], cy[selected])) + self._roi_offset()
+        if "measurements" in outputs:
+            curves = None if self.curves is None else {
+                name: tuple(map(tuple, np.asarray(curve).reshape(-1, 2).tolist()))
+                for name, curve in self.curves.items()}
+            debug["measurements"] = self._cached(
+                "measure", key + (tuple(sorted((curves or {}).items())),),
+                lambda: measure_cells(stages["markers_ws"], kept[selected], self._roi_image(),
+                                      self._roi_offset(), curves))
+        if "colocalization" in outputs:
+            n_ch = 1 if self.img.ndim == 2 else self.img.shape[2]
+            markers = self.markers
+            if markers is None:
+                markers = {c: None for c in range(n_ch) if c != channel}
+            if not markers:
+                raise ValueError("No marker channels to measure")
+            missing = [c for c in markers if not 0 <= c < n_ch]
+            if missing:
+                raise ValueError(f"Marker channels {missing} not in image with {n_ch} channels")
+            measured = debug.get("measurements")
+            debug["colocalization"] = self._cached(
+                "colocalize", key + (tuple(sorted(markers.items())),),
+                lambda: self._colocalize(stages["markers_ws"], kept[selected], markers, measured))
+            if measured is not None:
+                positive = debug["colocalization"]["positive"]
+                debug["measurements"] = dict(measured, **{
+                    f"positive_ch{c}": positive[:, i]
+                    for i, c in enumerate(debug["colocalization"]["channels"])})
+        if cell_band is not None and "measurements" in debug:
+            debug["measurements"] = dict(debug["measurements"], band=cell_band[selected])
+
+        return int(np.count_nonzero(selected)), vis_numbers, debug
+
+    def _base(self, channel, blur_ksize, maxima_ksize):
+        """
+        Sets up the stages that don't depend on peak_thresh_frac or min_area:
+        normalize up to the local maxima and connected components (plus the
+        touching statistic of engine "auto", which uses min_area)
+        Engine "auto" also checks engine parity in _segment
+        Returns LazyStages, which runs (or fetches from cache) each stage when
+        its result is first used, and the cache key of the last stage
+        """
+        img = self.img
+        if img is not self._cache_img:
+            self.clear_cache()
+            self._cache_img = img
+
+        # Each key extends the key of the stage it depends on, so changing a
+        # parameter only invalidates the stages downstream of where it is used
+        roi = None if self.roi is None else tuple(int(v) for v in self.roi)
+        k_norm = (channel, self.norm_range, roi)
+        native = self.native_depth and np.dtype(img.dtype) == np.uint16
+        k_bin = k_norm + (blur_ksize, self.otsu_value) + (("native",) if native else ())
+        k_max = k_bin + (maxima_ksize,)
+
+        stages = LazyStages()
+        stages.defer(("nuclei_norm",), lambda: self._cached(
+            "normalize", k_norm, lambda: self._normalize(channel)))
+        stages.defer(("blur", "otsu_value", "binary"), lambda: self._cached(
+            "threshold", k_bin, lambda nuclei: self._threshold(nuclei, blur_ksize),
+            lambda: (self._roi_image(channel) if native else stages["nuclei_norm"],)))
+        stages.defer(("dist", "dist_blur"), lambda: self._cached(
+            "distance", k_bin, self._distance,
+            lambda: (stages["binary"],)))
+        stages.defer(("connected",), lambda: self._cached(
+            "connected", k_bin, self._connected,
+            lambda: (stages["binary"],)))
+        stages.defer(("components",), lambda: stages["connected"][:3] + (self._cached(
+            "component_max", k_bin, lambda connected, dist: component_argmax(connected[1],
+                                                                              connected[0], dist),
+            lambda: (stages["connected"], stages["dist"])),))
+        stages.defer(("touching",), lambda: self._cached(
+            "touching", k_bin + (self.min_area,), self._touching,
+            lambda: (stages["components"], stages["dist"])))
+        stages.defer(("local_max",), lambda: self._cached(
+            "maxima", k_max, lambda dist_blur, binary: self._local_maxima(dist_blur, binary,
+                                                                          maxima_ksize),
+            lambda: (stages["dist_blur"], stages["binary"])))
+        stages.defer(("dist_max",), lambda: (
+            stages["dist"].max() if self.dist_max is None else self.dist_max))
+        return stages, k_max
+
+    def _segment(self,
+                 channel,
+                 max_area,
+                 blur_ksize,
+                 maxima_ksize,
+                 dilate_iters,
+                 do_seed_supplement):
+        """
+        Sets up every stage up to the area filter and the cell centroids with
+        the engine in self.engine; "auto" is resolved here, from cache if possible
+        Returns LazyStages and the cache key of the final stage
+        """
+        if self.engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {self.engine}")
         if blur_ksize % 2 == 0:
             blur_ksize += 1
-        blur = cv.GaussianBlur(nuclei_norm, (blur_ksize, blur_ksize), 0)
+        if maxima_ksize % 2 == 0:
+            maxima_ksize += 1
+
+        stages, k_max = self._base(channel, blur_ksize, maxima_ksize)
+
+        k_seeds = k_max + (self.peak_thresh_frac, self.dist_max)
+        if do_seed_supplement:
+            k_seeds = k_seeds + (self.min_area, max_area)
+
+        # Seeds read the base stages from the mapping; inputs resolves them first
+        # Defined for both engines, the components engine only builds them as debug image
+        seed_inputs = ("dist_max", "local_max", "dist_blur") + (
+            ("components",) if do_seed_supplement else ())
+        stages.defer(("seeds",), lambda: self._cached(
+            "seeds", k_seeds, lambda *_: self._seeds(stages, max_area, do_seed_supplement),
+            lambda: [stages[name] for name in seed_inputs]))
+
+        engine = self.engine
+        if engine == "auto":
+            engine = "watershed"
+            if stages["touching"] <= self.auto_touching:
+                # Components only where they verifiably count what watershed counts
+                k_parity = k_seeds + (dilate_iters, self.min_area, max_area)
+                if self._cached(
+                        "parity", k_parity,
+                        lambda nuclei_norm, binary, seeds: self._engines_agree(
+                            nuclei_norm, binary, seeds, max_area, dilate_iters),
+                        lambda: (stages["nuclei_norm"], stages["binary"], stages["seeds"])):
+                    engine = "components"
+        stages["engine"] = engine
+
+        if engine == "components":
+            # Labels as the watershed leaves them: 1 = background, cells from 2
+            k_kept = k_max + ("components", self.min_area, max_area)
+            stages.defer(("markers_ws",), lambda: self._cached(
+                "relabel", k_max, lambda connected: connected[1] + 1,
+                lambda: (stages["connected"],)))
+            stages.defer(("kept",), lambda: self._cached(
+                "filter", k_kept, lambda connected: self._filter_components(connected[2], max_area),
+                lambda: (stages["connected"],)))
+            stages.defer(("cell_areas", "cx", "cy"), lambda: self._cached(
+                "centroids", k_kept,
+                lambda connected, kept: (connected[2][kept - 1],) + tuple(connected[3][kept - 1].T),
+                lambda: (stages["connected"], stages["kept"])))
+            return stages, k_kept
+
+        k_ws = k_seeds + (dilate_iters,)
+        k_kept = k_ws + (self.min_area, max_area)
+        stages.defer(("markers_ws",), lambda: self._cached(
+            "watershed", k_ws,
+            lambda nuclei_norm, binary, seeds: self._watershed(nuclei_norm, binary,
+                                                               seeds, dilate_iters),
+            lambda: (stages["nuclei_norm"], stages["binary"], stages["seeds"])))
+        stages.defer(("kept",), lambda: self._cached(
+            "filter", k_kept, lambda markers_ws: self._filter_area(markers_ws, max_area),
+            lambda: (stages["markers_ws"],)))
+        stages.defer(("cell_areas", "cx", "cy"), lambda: self._cached(
+            "centroids", k_kept, lambda markers_ws, kept: label_centroids(markers_ws, kept),
+            lambda: (stages["markers_ws"], stages["kept"])))
+        return stages, k_kept
+
+    def run_preview(self,
+                    max_side: int = 400,
+                    channel: int = 2,
+                    max_area: int = 20000,
+                    blur_ksize: int = 3,
+                    maxima_ksize: int = 7,
+                    dilate_iters: int = 2,
+                    do_seed_supplement: bool = True,
+                    outputs=ALL_OUTPUTS):
+        """
+        Runs the pipeline on a cached downsampled copy of the image (or roi) whose
+        longest side is max_side, with areas and kernel sizes scaled to match
+        Count is approximate; returns the same (count, overlay, debug) as run(),
+        with debug centroids scaled back to full image coordinates
+        """
+        if self.img is not self._cache_img:
+            self.clear_cache()
+            self._cache_img = self.img
+
+        roi = None if self.roi is None else tuple(int(v) for v in self.roi)
+        if (max_side, roi) not in self._proxies:
+            src = self._roi_image()
+            h, w = src.shape[:2]
+            scale = min(1.0, max_side / max(h, w))
+            if scale < 1.0:
+                size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+                small = cv.resize(src, size, interpolation=cv.INTER_AREA)
+            else:
+                small = src
+            self._proxies[max_side, roi] = (scale, CellCount(small, self.peak_thresh_frac, self.min_area))
+        scale, proxy = self._proxies[max_side, roi]
+
+        area_scale = scale * scale
+        proxy.peak_thresh_frac = self.peak_thresh_frac
+        proxy.profiler = self.profiler
+        proxy.region_select = self.region_select
+        proxy.engine = self.engine
+        proxy.native_depth = self.native_depth
+        proxy.markers = self.markers
+        proxy.auto_touching = self.auto_touching
+        proxy.region = None if self.region is None else self._roi_region() * scale
+        proxy.bands = None if self.bands is None else [band * scale for band in self._roi_bands()]
+        proxy.min_area = max(1, int(round(self.min_area * area_scale)))
+        count, vis_numbers, debug = proxy.run(channel=channel,
+                         max_area=max(1, int(round(max_area * area_scale))),
+                         blur_ksize=scale_ksize(blur_ksize, scale, 1),
+                         maxima_ksize=scale_ksize(maxima_ksize, scale, 3),
+                         dilate_iters=max(1, int(round(dilate_iters * scale))),
+                         do_seed_supplement=do_seed_supplement,
+                         outputs=outputs)
+        if "centroids" in debug:
+            debug["centroids"] = debug["centroids"] / scale + self._roi_offset()
+        if "bands" in debug:
+            # Band areas in full resolution pixels
+            bands = debug["bands"]
+            bands["areas"] = bands["areas"] / area_scale
+            with np.errstate(invalid="ignore", divide="ignore"):
+                bands["density"] = np.where(bands["areas"] > 0, bands["counts"] / bands["areas"], 0.0)
+        return count, vis_numbers, debug
+
+    def _normalize(self, channel):
+        nuclei = self._roi_image(channel)
+
+        # --- Normalize ---
+        if self.norm_range is None:
+            if np.issubdtype(nuclei.dtype, np.integer):
+                # Written as 8 bit in the same pass, no intermediate in the input
+                # type; rounding to 8 bit gives what astype did to the rounded values
+                return cv.normalize(nuclei, None, 0, 255, cv.NORM_MINMAX, dtype=cv.CV_8U)
+            # Float input (e.g. mean projections) is truncated, as it always was
+            return cv.normalize(nuclei, None, 0, 255, cv.NORM_MINMAX).astype(np.uint8)
+
+        # Same scale and shift cv.normalize would use for this (min, max)
+        lo, hi = self.norm_range
+        scale = 255.0 / (hi - lo) if hi - lo > np.finfo(float).eps else 0.0
+        return cv.convertScaleAbs(nuclei, alpha=scale, beta=-lo * scale)
+
+    def _threshold(self, nuclei, blur_ksize):
+        # --- Gentle blur ---
+        # nuclei is nuclei_norm, or the 16-bit channel itself with native_depth
+        blur = cv.GaussianBlur(nuclei, (blur_ksize, blur_ksize), 0)
 
         # --- Otsu threshold ---
-        otsu_val, binary = cv.threshold(blur, 0, 255, cv.THRESH_BINARY + cv.THRESH_OTSU)
+        if blur.dtype != np.uint8:
+            # Histogram of every 16-bit value, binary mask made as 8 bit directly
+            otsu_val = self.otsu_value
+            if otsu_val is None:
+                hist = cv.calcHist([blur], [0], None, [65536], [0, 65536])
+                otsu_val = otsu_threshold(hist.ravel())
+            binary = cv.compare(blur, float(otsu_val), cv.CMP_GT)
+            return blur, otsu_val, binary
+        if self.otsu_value is None:
+            otsu_val, binary = cv.threshold(blur, 0, 255, cv.THRESH_BINARY + cv.THRESH_OTSU)
+        else:
+            otsu_val = self.otsu_value
+            _, binary = cv.threshold(blur, otsu_val, 255, cv.THRESH_BINARY)
+        return blur, otsu_val, binary
 
+    def _distance(self, binary):
         # --- Distance transform ---
         dist = cv.distanceTransform(binary, cv.DIST_L2, 5)
         dist_blur = cv.GaussianBlur(dist, (3, 3), 0)
+        return dist, dist_blur
 
+    def _local_maxima(self, dist_blur, binary, maxima_ksize):
         # --- Local maxima seeds ---
-        if maxima_ksize % 2 == 0:
-            maxima_ksize += 1
         kernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, (maxima_ksize, maxima_ksize))
-        dist_dil = cv.dilate(dist_blur, kernel)
-        local_max = (dist_blur == dist_dil)
+        dist_dil = cv.dilate(dist_blur, kernel,
+                             dst=self._buffer("dist_dil", dist_blur.shape, dist_blur.dtype))
+        return (dist_blur == dist_dil) & (binary > 0)
+
+    def _connected(self, binary):
+        # --- Connected components, their areas and centroids ---
+        num_cc, cc_labels, cc_stats, cc_centroids = cv.connectedComponentsWithStats(
+            binary, connectivity=8)
+        return num_cc, cc_labels, np.ascontiguousarray(cc_stats[:, cv.CC_STAT_AREA]), cc_centroids
+
+    def _touching(self, components, dist):
+        # --- Share of components that are touching nuclei, for engine "auto" ---
+        _, _, areas, argmax = components
+        return touching_fraction(areas, dist.ravel()[argmax], self.min_area)
+
+    def _engines_agree(self, nuclei_norm, binary, seeds, max_area, dilate_iters):
+        # --- Parity check of engine "auto": both engines on the central window ---
+        # The window cuts cells at its edge the same way for both engines
+        h, w = binary.shape
+        y0 = max(0, (h - AUTO_PROBE_SIDE) // 2)
+        x0 = max(0, (w - AUTO_PROBE_SIDE) // 2)
+        window = (slice(y0, y0 + AUTO_PROBE_SIDE), slice(x0, x0 + AUTO_PROBE_SIDE))
+        binary = np.ascontiguousarray(binary[window])
+        markers_ws = self._watershed(np.ascontiguousarray(nuclei_norm[window]), binary,
+                                     np.ascontiguousarray(seeds[window]), dilate_iters)
+        _, _, areas, _ = self._connected(binary)
+        return bool(len(self._filter_area(markers_ws, max_area))
+                    == len(self._filter_components(areas, max_area)))
 
-        peak_thresh = self.peak_thresh_frac * dist.max()
-        seeds = (local_max & (dist_blur > peak_thresh) & (binary > 0)).astype(np.uint8) * 255
+    def _seeds(self, stages, max_area, do_seed_supplement):
+        peak_thresh = self.peak_thresh_frac * stages["dist_max"]
+        above = stages["local_max"] & (stages["dist_blur"] > peak_thresh)
+        seeds = above.view(np.uint8) * 255
 
         # --- Optional seed supplementation (adds 1 seed to components with 0 seeds) ---
         if do_seed_supplement:
-            num_cc, cc_labels, cc_stats, _ = cv.connectedComponentsWithStats(binary, connectivity=8)
-            supp_seeds = seeds.copy()
+            num_cc, cc_labels, areas, argmax = stages["components"]
+            seed_counts = np.bincount(cc_labels[seeds > 0], minlength=num_cc)
 
-            for i in range(1, num_cc):
-                area = cc_stats[i, cv.CC_STAT_AREA]
-                if area < self.min_area or area > max_area:
-                    continue
+            needs_seed = (seed_counts == 0) & (areas >= self.min_area) & (areas <= max_area)
+            needs_seed[0] = False
 
-                comp_mask = (cc_labels == i)
-                if np.count_nonzero(seeds[comp_mask]) == 0:
-                    dist_in_comp = dist.copy()
-                    dist_in_comp[~comp_mask] = 0
-                    y, x = np.unravel_index(np.argmax(dist_in_comp), dist_in_comp.shape)
-                    cv.circle(supp_seeds, (int(x), int(y)), 1, 255, -1)
+            ys, xs = np.divmod(argmax[needs_seed], seeds.shape[1])
+            for x, y in zip(xs, ys):
+                cv.circle(seeds, (int(x), int(y)), 1, 255, -1)
 
-            seeds = supp_seeds
+        return seeds
 
+    def _watershed(self, nuclei_norm, binary, seeds, dilate_iters):
         # --- Build markers and run watershed ---
+        # markers is a fresh array that becomes markers_ws (watershed works in place)
         _, markers = cv.connectedComponents(seeds)
-        markers = markers + 1
+        markers += 1
 
         k3 = cv.getStructuringElement(cv.MORPH_ELLIPSE, (3, 3))
-        sure_bg = cv.dilate(binary, k3, iterations=dilate_iters)
-        unknown = cv.subtract(sure_bg, seeds)
+        sure_bg = cv.dilate(binary, k3, iterations=dilate_iters,
+                            dst=self._buffer("sure_bg", binary.shape, binary.dtype))
+        unknown = cv.subtract(sure_bg, seeds, dst=sure_bg)
         markers[unknown == 255] = 0
 
-        base_for_ws = cv.cvtColor(nuclei_norm, cv.COLOR_GRAY2BGR)
-        markers_ws = cv.watershed(base_for_ws, markers.copy())
+        # cv.watershed needs a 3-channel image
+        base_for_ws = cv.cvtColor(nuclei_norm, cv.COLOR_GRAY2BGR,
+                                  dst=self._buffer("base_for_ws", nuclei_norm.shape + (3,), np.uint8))
+        return cv.watershed(base_for_ws, markers)
 
+    def _filter_area(self, markers_ws, max_area):
         # --- Filter by area ---
-        obj_ids = np.unique(markers_ws)
-        obj_ids = obj_ids[(obj_ids != 1) & (obj_ids != -1) & (obj_ids != 0)]
+        # Label -1 marks watershed boundaries, so areas are counted with a +1 shift
+        shifted = np.add(markers_ws, 1, out=self._buffer("shifted", markers_ws.shape, markers_ws.dtype))
+        areas = np.bincount(shifted.ravel())[1:]
+        obj_ids = np.flatnonzero(areas)
+        obj_ids = obj_ids[obj_ids > 1]
 
-        kept = []
-        for oid in obj_ids:
-            area = np.count_nonzero(markers_ws == oid)
-            if self.min_area <= area <= max_area:
-                kept.append(oid)
+        obj_areas = areas[obj_ids]
+        return obj_ids[(obj_areas >= self.min_area) & (obj_areas <= max_area)]
 
+    def _filter_components(self, areas, max_area):
+        # --- Filter components by area; ids shifted to the labels of relabel ---
+        obj_ids = np.flatnonzero((areas >= self.min_area) & (areas <= max_area))
+        return obj_ids[obj_ids > 0] + 1
+
+    def _select(self, markers_ws, kept, areas, cx, cy):
+        """
+        Returns boolean mask over kept cells that lie in self.region
+        Polygon is only rasterized over its bounding box
+        """
+        if self.region is None:
+            return np.ones(len(kept), dtype=bool)
+
+        h, w = markers_ws.shape
+        polygon = self._roi_region().astype(np.int32)
+        x0, y0 = np.maximum(polygon.min(axis=0), 0)
+        x1, y1 = np.minimum(polygon.max(axis=0) + 1, (w, h))
+        if x1 <= x0 or y1 <= y0:
+            return np.zeros(len(kept), dtype=bool)
+        region_mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        cv.fillPoly(region_mask, [polygon - (x0, y0)], 1)
+
+        if self.region_select == "overlap":
+            labels = markers_ws[y0:y1, x0:x1][region_mask > 0]
+            size = int(kept.max()) + 1 if len(kept) else 1
+            inside = np.bincount(labels[labels > 0], minlength=size)
+            return 2 * inside[kept] >= areas
+
+        # Cell belongs to the region if the pixel its number is drawn at does
+        ix, iy = cx.astype(np.intp), cy.astype(np.intp)
+        in_box = (ix >= x0) & (ix < x1) & (iy >= y0) & (iy < y1)
+        selected = np.zeros(len(kept), dtype=bool)
+        selected[in_box] = region_mask[iy[in_box] - y0, ix[in_box] - x0] > 0
+        return selected
+
+    def _band_raster(self, shape):
+        """
+        Rasterizes the bands over the bounding box of all band polygons, in
+        processing box coordinates: 1..N = band, 0 = none. Pixels on a curve
+        shared by two bands go to the later one, so every cell counts once
+        Returns raster, its box (x0, y0) and the area of every band in pixels
+        """
+        h, w = shape
+        polygons = [band.astype(np.int32) for band in self._roi_bands()]
+        points = np.concatenate(polygons) if polygons else np.zeros((0, 2), dtype=np.int32)
+        x0, y0 = np.maximum(points.min(axis=0), 0) if len(points) else (0, 0)
+        x1, y1 = np.minimum(points.max(axis=0) + 1, (w, h)) if len(points) else (0, 0)
+        x1, y1 = max(x1, x0), max(y1, y0)
+
+        raster = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8 if len(polygons) < 256 else np.uint16)
+        for i, polygon in enumerate(polygons, 1):
+            cv.fillPoly(raster, [polygon - (x0, y0)], i)
+        areas = np.bincount(raster.ravel(), minlength=len(polygons) + 1)[1:]
+        return raster, (int(x0), int(y0)), areas
+
+    @staticmethod
+    def _assign_bands(raster, box, cx, cy):
+        """
+        Returns band (1..N, 0 = none) of the pixel every cell's number is drawn at,
+        the same pixel region selection uses
+        """
+        x0, y0 = box
+        h, w = raster.shape
+        ix, iy = cx.astype(np.intp) - x0, cy.astype(np.intp) - y0
+        inside = (ix >= 0) & (ix < w) & (iy >= 0) & (iy < h)
+        cell_band = np.zeros(len(cx), dtype=np.intp)
+        cell_band[inside] = raster[iy[inside], ix[inside]]
+        return cell_band
+
+    def _colocalize(self, markers_ws, ids, markers, measured=None):
+        """
+        Classifies cells ids by the mean intensity of every marker channel
+        inside their label; means are taken from measured (measure_cells
+        columns) if given, otherwise all channels are summed in one pass
+        """
+        channels = sorted(markers)
+        if measured is not None:
+            means = np.array([measured[f"mean_ch{c}"] for c in channels])
+        else:
+            means = label_means(markers_ws, ids, self._roi_image(), channels)
+        thresholds = np.array([cell_otsu_threshold(m) if markers[c] is None else float(markers[c])
+                               for c, m in zip(channels, means)])
+        positive = (means > thresholds[:, None]).T
+        return {"channels": channels,
+                "thresholds": thresholds,
+                "means": means.T,
+                "positive": positive,
+                "counts": marker_combinations(positive, channels)}
+
+    def _overlay(self, nuclei_norm, cx, cy):
         # --- Number overlay ---
-        vis_numbers = base_for_ws.copy()
+        vis_numbers = cv.cvtColor(nuclei_norm, cv.COLOR_GRAY2BGR)
         font = cv.FONT_HERSHEY_SIMPLEX
         font_scale = 0.35
         thickness = 1
         color = (0, 255, 255)
 
-        label_id = 1
-        for oid in kept:
-            mask = (markers_ws == oid).astype(np.uint8)
-            M = cv.moments(mask)
-            if M["m00"] == 0:
-                continue
-            cx = int(M["m10"] / M["m00"])
-            cy = int(M["m01"] / M["m00"])
-            cv.putText(vis_numbers, str(label_id), (cx, cy), font, font_scale, color, thickness, cv.LINE_AA)
-            label_id += 1
-
-        debug = {
-            "nuclei_norm": nuclei_norm,
-            "blur": blur,
-            "binary": binary,
-            "dist": dist,
-            "seeds": seeds,
-            "markers_ws": markers_ws,
-            "otsu_value": otsu_val
-        }
-
-        return len(kept), vis_numbers, debug
+        for label_id, (x, y) in enumerate(zip(cx, cy), 1):
+            cv.putText(vis_numbers, str(label_id), (int(x), int(y)),
+                       font, font_scale, color, thickness, cv.LINE_AA)
+
+        if self.region is not None:
+            polygon = self._roi_region().astype(np.int32).reshape(-1, 1, 2)
+            line = max(1, max(vis_numbers.shape[:2]) // 400)
+            cv.polylines(vis_numbers, [polygon], True, (0, 0, 255), line)
+
+        return vis_numbers
@@ -1,20 +1,34 @@
-import cv2 as cv
-from PySide6.QtCore import Qt
-from PySide6.QtGui import QImage, QPixmap
+import os
+
+import numpy as np
+from PySide6.QtCore import Qt, QThreadPool
 from PySide6.QtWidgets import (QMainWindow,
                                QWidget, QVBoxLayout,
                                QHBoxLayout, QLabel,
-                               QSlider, QPushButton)
+                               QSlider, QPushButton,
+                               QProgressBar, QMessageBox,
+                               QFileDialog)
 
 from cellcount import CellCount
 from infobutton import InfoButton
+from measurements import CellTableWriter
+from overlayview import OverlayView
+from profiling import StageProfiler
+from sweep import ParameterSweep, PTF_VALUES, MIN_AREA_VALUES
+from sweepplot import SweepPlot
+from worker import Worker
 
 
 class CellCountWindow(QMainWindow):
-    def __init__(self, img):
+    def __init__(self, img, region=None, roi=None, bands=None, curves=None):
         super().__init__()
 
         self.img = img
+        self.region = region  # polygon cells are counted in, None = whole image
+        self.bands = bands  # polygons cells are also counted per band in, or None
+        self.roi = roi  # (x0, y0, x1, y1) box segmented, None = whole image
+        self.curves = curves  # {name: polyline} measured against every cell, or None
+        self.export_path = None  # cell table requested by Export, written after the next run
         self.setWindowTitle("Cell Counting Window")
 
         # --- Layout structure ---
@@ -23,7 +37,7 @@ class CellCountWindow(QMainWindow):
         # Control Panel
         left_container = QWidget()
         left_layout = QVBoxLayout(left_container)
-        left_container.setFixedSize(400, 200)
+        left_container.setFixedSize(400, 420)
         # 1st and 2nd row: peak_thresh_frac information and slider
         container_1 = QWidget()
         layout_1 = QHBoxLayout(container_1)
@@ -34,6 +48,9 @@ class CellCountWindow(QMainWindow):
         layout_3 = QHBoxLayout(container_3)
         container_4 = QWidget()
         layout_4 = QHBoxLayout(container_4)
+        # 5th row: parameter suggestion
+        container_5 = QWidget()
+        layout_5 = QHBoxLayout(container_5)
         # Results Display
         right_container = QWidget()
         right_layout = QVBoxLayout(right_container)
@@ -48,6 +65,7 @@ class CellCountWindow(QMainWindow):
         self.ptf_slider.setRange(25, 50)
         self.ptf_slider.setValue(35)
         self.ptf_slider.sliderReleased.connect(self.ptf_changed)
+        self.ptf_slider.valueChanged.connect(self.ptf_moved)
         self.current_ptf = self.ptf_slider.value() / 100
         ptf_label = QLabel("peak_thresh_frac:")
         ptf_info = InfoButton("Sensitivity of cell detection\n"
@@ -65,6 +83,7 @@ class CellCountWindow(QMainWindow):
         self.min_slider.setRange(20, 200)
         self.min_slider.setValue(40)
         self.min_slider.sliderReleased.connect(self.min_area_changed)
+        self.min_slider.valueChanged.connect(self.min_area_moved)
         self.current_min = self.min_slider.value()
         min_info = InfoButton("Minimum size counted\n" 
                               "as cell during area \n" 
@@ -72,23 +91,68 @@ class CellCountWindow(QMainWindow):
         min_area_label = QLabel("min_area:")
         self.min_area_value = QLabel(f"{self.current_min}px")
 
+        # --- Parameter sweep controls ---
+        suggest_info = InfoButton("Counts cells for every\n"
+                                  "slider position at once,\n"
+                                  "plots count against\n"
+                                  "peak_thresh_frac and moves\n"
+                                  "sliders to the most\n"
+                                  "stable setting.")
+        self.suggest_button = QPushButton("Suggest")
+        self.suggest_button.setFixedSize(100, 25)
+        self.suggest_button.clicked.connect(self.suggest)
+        export_info = InfoButton("Saves area, centroid,\n"
+                                 "intensities and distance\n"
+                                 "to the lines of every\n"
+                                 "counted cell as .csv\n"
+                                 "or .parquet table.")
+        self.export_button = QPushButton("Export")
+        self.export_button.setFixedSize(100, 25)
+        self.export_button.clicked.connect(self.export_cells)
+        self.sweep_plot = SweepPlot()
+        self.sweep_counts = None  # counts[ptf index, min_area index] from last sweep
+
         # --- Cancel controls ---
         cancel_button = QPushButton("Cancel")
         cancel_button.clicked.connect(self.cancel)
         cancel_button.setFixedSize(100, 25)
 
-        # --- Initial cellcount ---
+        # --- Cellcount and background worker state ---
         self.analysis = CellCount(img=self.img,
                                   peak_thresh_frac=self.current_ptf,
                                   min_area=self.current_min)
+        self.analysis.roi = roi
+        # Stage timings of the last full run, shown as tooltip of the count
+        self.profiler = StageProfiler()
+        self.analysis.profiler = self.profiler
+        # Separate instance for drag previews, only used on the GUI thread
+        self.preview_analysis = CellCount(img=self.img,
+                                          peak_thresh_frac=self.current_ptf,
+                                          min_area=self.current_min)
+        self.preview_analysis.roi = roi
+        # Separate instance for parameter sweeps, only used by the sweep worker
+        self.sweep_analysis = CellCount(img=self.img,
+                                        peak_thresh_frac=self.current_ptf,
+                                        min_area=self.current_min)
+        self.sweep_analysis.roi = roi
+        self.pool = QThreadPool.globalInstance()
+        self.running = False
+        self.pending = None  # latest (peak_thresh_frac, min_area, region, bands, curves) not yet computed
 
         # --- Result display ---
-        self.cell_count_label = QLabel(f"Cell Count: {self.analysis.run()[0]}")
-        self.image = QLabel()
-        h, w = img.shape[:2]
+        self.cell_count_label = QLabel("Cell Count: ...")
+        self.busy = QProgressBar()
+        self.busy.setRange(0, 0)  # indeterminate
+        self.busy.setFixedHeight(10)
+        self.busy.hide()
+        if roi is None:
+            h, w = img.shape[:2]
+        else:
+            w, h = roi[2] - roi[0], roi[3] - roi[1]
         display_w = min(400, w)
         display_h = min(400, h)
-        self.image.setFixedSize(display_w, display_h)
+        # Cells are drawn at screen resolution; wheel zooms, drag pans
+        self.image = OverlayView(display_w, display_h)
 
 
         # Widgets added left to right
@@ -104,15 +168,23 @@ class CellCountWindow(QMainWindow):
         layout_4.addWidget(min_min)
         layout_4.addWidget(self.min_slider)
         layout_4.addWidget(min_max)
+        layout_5.addWidget(suggest_info)
+        layout_5.addWidget(self.suggest_button)
+        layout_5.addWidget(export_info)
+        layout_5.addWidget(self.export_button)
+        layout_5.addStretch()
         # Widgets added top to bottom
         left_layout.addWidget(container_1)
         left_layout.addWidget(container_2)
         left_layout.addWidget(container_3)
         left_layout.addWidget(container_4)
+        left_layout.addWidget(container_5)
+        left_layout.addWidget(self.sweep_plot)
         left_layout.addWidget(cancel_button)
 
         # Widgets added top to bottom
         right_layout.addWidget(self.cell_count_label)
+        right_layout.addWidget(self.busy)
         right_layout.addWidget(self.image)
         # Widgets added left to right
         main_layout.addWidget(left_container)
@@ -123,33 +195,224 @@ class CellCountWindow(QMainWindow):
         # --- Displays results ---
         self.update_preview()
 
-    def show_image(self, img):
+    def show_cells(self, debug):
         """
-        input: img
-        creates QImage from img and QPixmap from QImage
-        Pixmap displayed as preview image in CellCountWindow
+        input: debug dict of a run with centroids (and nuclei_norm for full runs)
+        Shows the normalized nuclei channel with markers and numbers of the counted cells
         """
-        if img.ndim == 2:
-            img = cv.cvtColor(img, cv.COLOR_GRAY2BGR)
+        offset = self.analysis._roi_offset()
+        if "nuclei_norm" in debug:
+            self.image.set_image(debug["nuclei_norm"])
+        region = None if self.region is None else np.asarray(self.region).reshape(-1, 2) - offset
+        bands = None if self.bands is None else [np.asarray(b).reshape(-1, 2) - offset for b in self.bands]
+        self.image.set_cells(debug["centroids"] - offset, region, bands)
 
-        h, w = img.shape[:2]
-        qimg = QImage(img.data, w, h, img.strides[0],QImage.Format_BGR888)
-        pixmap = QPixmap.fromImage(qimg)
-        pixmap = pixmap.scaled(self.image.width(), self.image.height(), Qt.KeepAspectRatio,
-                                                Qt.SmoothTransformation)
-        self.image.setPixmap(pixmap)
+    def count_text(self, count, debug, suffix=""):
+        """
+        Returns label text: total count plus count and density of every band
+        """
+        text = f"Cell Count: {count}{suffix}"
+        if "bands" in debug:
+            bands = debug["bands"]
+            for i, (n, density) in enumerate(zip(bands["counts"], bands["density"]), 1):
+                text += f"\nBand {i}: {n} ({density * 1e6:.0f} per Mpx)"
+        return text
 
 
     def update_preview(self):
         """
-        Runs CellCount with current peak_thresh_frac and min_area values
+        Requests a CellCount run with current peak_thresh_frac and min_area values
+        Runs on a background thread; requests made while a run is in flight are
+        coalesced so only the latest parameters are computed
+        """
+        self.pending = (self.current_ptf, self.current_min, self.region, self.bands, self.curves)
+        self.update_plot()
+        if not self.running:
+            self.start_analysis()
+
+    def start_analysis(self):
+        """
+        Starts a worker for the pending parameters and shows busy indicator
+        """
+        ptf, min_area, region, bands, curves = self.pending
+        self.pending = None
+        # Only one run is in flight at a time, so the shared CellCount (and its
+        # stage cache) is never touched from two threads
+        self.analysis.peak_thresh_frac = ptf
+        self.analysis.min_area = min_area
+        self.analysis.region = region
+        self.analysis.bands = bands
+        self.analysis.curves = curves
+        self.profiler.clear()
+
+        # Only centroids; markers and numbers are drawn by the view
+        outputs = ("centroids", "nuclei_norm")
+        if self.export_path is not None:
+            outputs += ("measurements",)
+        worker = Worker(self.analysis.run, outputs=outputs)
+        worker.signals.finished.connect(self.analysis_done)
+        worker.signals.failed.connect(self.analysis_failed)
+        self.running = True
+        self.busy.show()
+        self.pool.start(worker)
+
+    def analysis_done(self, result):
+        """
         Displays updated preview and updated cell count in CellCountWindow
+        Result is dropped if newer parameters arrived while it was computed
+        """
+        self.running = False
+        if self.pending is not None:
+            self.start_analysis()
+            return
+
+        self.busy.hide()
+        if self.ptf_slider.isSliderDown() or self.min_slider.isSliderDown():
+            return  # live preview is showing newer values; release starts a new run
+        count, _, debug = result
+        self.show_cells(debug)
+        self.cell_count_label.setText(self.count_text(count, debug))
+        if self.export_path is not None and "measurements" in debug:
+            self.write_cells(debug["measurements"])
+        # Only stages whose inputs changed were recomputed
+        summary = self.profiler.format_summary() or "All stages cached"
+        self.cell_count_label.setToolTip(f"<pre>{summary}</pre>")
+
+    def analysis_failed(self, message):
+        """
+        Shows error from worker and starts any pending run
+        """
+        self.running = False
+        if self.pending is not None:
+            self.start_analysis()
+            return
+
+        self.busy.hide()
+        self.export_path = None
+        self.cell_count_label.setText("Cell Count: -")
+        QMessageBox.critical(self, "Error", f"Cell counting failed:\n{message}")
+
+    def live_preview(self):
+        """
+        Runs CellCount on a downsampled proxy sized to the preview
+        Displays approximate result while a slider is being dragged
+        """
+        self.preview_analysis.peak_thresh_frac = self.current_ptf
+        self.preview_analysis.min_area = self.current_min
+        self.preview_analysis.region = self.region
+        self.preview_analysis.bands = self.bands
+        self.update_plot()
+        max_side = max(self.image.width(), self.image.height())
+        count, _, debug = self.preview_analysis.run_preview(max_side=max_side,
+                                                            outputs=("centroids",))
+        self.show_cells(debug)
+        self.cell_count_label.setText(self.count_text(count, debug, " (preview)").replace(": ", ": ~"))
+
+    def suggest(self):
+        """
+        Runs a parameter sweep over all slider positions on a background thread
+        """
+        self.sweep_analysis.region = self.region
+        worker = Worker(self.run_sweep)
+        worker.signals.finished.connect(self.sweep_done)
+        worker.signals.failed.connect(self.sweep_failed)
+        self.suggest_button.setEnabled(False)
+        self.pool.start(worker)
+
+    def run_sweep(self):
+        """
+        Worker: counts for every slider position and the suggested parameters
+        """
+        return ParameterSweep(self.sweep_analysis).suggest(PTF_VALUES, MIN_AREA_VALUES)
+
+    def sweep_done(self, result):
         """
-        self.analysis.peak_thresh_frac = self.current_ptf
-        self.analysis.min_area = self.current_min
-        count, preview, = self.analysis.run()[:2]
-        self.show_image(preview)
-        self.cell_count_label.setText(f"Cell Count: {count}")
+        Stores sweep counts and moves sliders to the suggested parameters
+        """
+        ptf, min_area, _, counts = result
+        self.suggest_button.setEnabled(True)
+        self.sweep_counts = counts
+        # Setting the sliders starts a normal (coalesced) update
+        self.ptf_slider.setValue(int(round(ptf * 100)))
+        self.min_slider.setValue(min_area)
+        self.update_plot()
+
+    def sweep_failed(self, message):
+        self.suggest_button.setEnabled(True)
+        QMessageBox.critical(self, "Error", f"Parameter sweep failed:\n{message}")
+
+    def update_plot(self):
+        """
+        Plots count against peak_thresh_frac for the current min_area from the
+        last sweep, without running CellCount
+        """
+        if self.sweep_counts is None:
+            return
+        j = int(self.current_min - MIN_AREA_VALUES[0])
+        self.sweep_plot.set_data(PTF_VALUES, self.sweep_counts[:, j], self.current_ptf)
+
+    def export_cells(self):
+        """
+        Asks for a file and saves the measurement table of the current
+        parameters; the table is computed with the next (cached) run
+        """
+        path, _ = QFileDialog.getSaveFileName(self, "Export cells", "cells.csv",
+                                              "Cell tables (*.csv *.parquet)")
+        if not path:
+            return
+        self.export_path = path
+        self.update_preview()
+
+    def write_cells(self, columns):
+        """
+        Writes measurement columns to export_path, replacing an existing CSV file
+        """
+        path, self.export_path = self.export_path, None
+        try:
+            if not path.endswith(".parquet") and os.path.exists(path):
+                os.remove(path)  # overwrite was confirmed in the file dialog
+            writer = CellTableWriter(path)
+            try:
+                writer.write(columns)
+            finally:
+                writer.close()
+        except (OSError, ValueError, ImportError) as e:
+            QMessageBox.critical(self, "Error", f"Export failed:\n{e}")
+
+    def set_region(self, region, bands=None, curves=None):
+        """
+        Counts cells inside a new region polygon (and per band, if given)
+        curves are the lines measured against every cell on export
+        Segmentation is cached, so only cell selection and overlay re-run
+        """
+        self.region = region
+        self.bands = bands
+        self.curves = curves
+        self.sweep_counts = None
+        self.sweep_plot.set_data([], [])
+        self.update_preview()
+
+    def ptf_moved(self):
+        """
+        Live preview while dragging, full update for keyboard and click changes
+        """
+        if not self.ptf_slider.isSliderDown():
+            self.ptf_changed()
+            return
+        self.current_ptf = self.ptf_slider.value() / 100
+        self.ptf_value.setText(f"{self.current_ptf}")
+        self.live_preview()
+
+    def min_area_moved(self):
+        """
+        Live preview while dragging, full update for keyboard and click changes
+        """
+        if not self.min_slider.isSliderDown():
+            self.min_area_changed()
+            return
+        self.current_min = self.min_slider.value()
+        self.min_area_value.setText(f"{self.current_min} px")
+        self.live_preview()
 
     def ptf_changed(self):
         """
@@ -171,4 +434,5 @@ class CellCountWindow(QMainWindow):
 
     def cancel(self):
         """Closes window"""
+        self.pending = None
         self.close()
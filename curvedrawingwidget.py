@@ -1,84 +1,129 @@
-from PySide6.QtCore import Qt, QPoint
-from PySide6.QtGui import QImage, QPixmap, QPainter, QPen
-from PySide6.QtWidgets import QWidget
+from PySide6.QtCore import Qt
+from PySide6.QtGui import QColor, QPainter, QPen
 
+from zoomview import ZoomPanView
 
-class CurveDrawingWidget(QWidget):
-    def __init__(self, img):
-        super().__init__()
-        self.img = img
+# Colors of the start curve, the curves between start and stop, and the stop curve
+START_COLOR = QColor(Qt.red)
+MIDDLE_COLOR = QColor(Qt.green)
+STOP_COLOR = QColor(Qt.blue)
 
-        # --- Storage for curves ---
-        self.start_curve = []
-        self.stop_curve = []
-        self.mode = "start"
 
-        # --- Setting display image size and generating pixmap ---
-        self.orig_h, self.orig_w = img.shape[:2]
+class CurveDrawingWidget(ZoomPanView):
+    def __init__(self, img, pyramid=None):
+        """
+        img: image curves are drawn on, or None while it is loading, in which
+        case pyramid (e.g. ImagePyramid.from_level of a thumbnail) is shown
+        until set_image is called with the full image
+        """
+        # --- Setting display size: image fitted into 400 x 400 ---
+        shape = img.shape if img is not None else pyramid.shape
+        self.orig_h, self.orig_w = shape[:2]
         self.display_w = min(400, self.orig_w)
         self.display_h = min(400, self.orig_h)
-
-        self.pixmap = self.get_scaled_pixmap()
-        self.setFixedSize(self.pixmap.width(), self.pixmap.height())
-
-    def get_scaled_pixmap(self):
+        scale = min(self.display_w / self.orig_w, self.display_h / self.orig_h)
+        super().__init__(max(1, round(self.orig_w * scale)), max(1, round(self.orig_h * scale)),
+                         rgb=True)
+
+        # --- Storage for curves: start, any middle curves, stop ---
+        self.curves = [[], []]
+        self.active = 0  # index of the curve clicks are added to
+
+        # Only the pyramid tiles in view are converted, never the full image
+        self.set_image(img, pyramid)
+
+    @property
+    def start_curve(self):
+        return self.curves[0]
+
+    @start_curve.setter
+    def start_curve(self, curve):
+        self.curves[0] = curve
+
+    @property
+    def stop_curve(self):
+        return self.curves[-1]
+
+    @stop_curve.setter
+    def stop_curve(self, curve):
+        self.curves[-1] = curve
+
+    @property
+    def middle_curves(self):
+        return self.curves[1:-1]
+
+    @property
+    def mode(self):
+        """"start", "stop" or "middle" depending on the active curve"""
+        if self.active == 0:
+            return "start"
+        return "stop" if self.active == len(self.curves) - 1 else "middle"
+
+    @mode.setter
+    def mode(self, mode):
+        if mode == "start":
+            self.active = 0
+        elif mode == "stop":
+            self.active = len(self.curves) - 1
+
+    def add_curve(self):
         """
-        Creates pixmap from input image
-        Scales pixmap size to widget size
+        Inserts a new curve just above the stop curve and makes it active; each
+        one splits the region into one more band
         """
-        img = self.img
-        if img.ndim == 2:
-            qimg = QImage(img.data, self.orig_w, self.orig_h, img.strides[0], QImage.Format_Grayscale8)
-        elif img.ndim == 3 and img.shape[2] == 3:
-            qimg = QImage(img.data, self.orig_w, self.orig_h, img.strides[0], QImage.Format_RGB888)
-        else:
-            raise ValueError(f"Unsupported image shape: {img.shape}")
+        self.curves.insert(len(self.curves) - 1, [])
+        self.active = len(self.curves) - 2
 
-        pixmap = QPixmap.fromImage(qimg)
-        pixmap = pixmap.scaled(self.display_w, self.display_h, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-
-        return pixmap
+    def clear_curves(self):
+        self.curves = [[], []]
+        self.active = 0
+        self.update()
 
     def mousePressEvent(self, event):
         """
-        Adds clicked point to the currently selected curve, updates line on display
+        Left click adds point to the currently selected curve, right (or middle)
+        drag pans the view
+        Clicks are ignored until the first pyramid of the image is built
         """
+        if self.pyramid is None:
+            return
         if event.button() == Qt.LeftButton:
-            #Coordinates scaled from display to original image coordinates
-            scale_x = self.orig_w / self.pixmap.width()
-            scale_y = self.orig_h / self.pixmap.height()
-            x = int(event.position().x() * scale_x)
-            y = int(event.position().y() * scale_y)
+            # Coordinates mapped from display to original image coordinates
+            x, y = self.to_image(event.position())
+            x = min(max(int(x), 0), self.orig_w - 1)
+            y = min(max(int(y), 0), self.orig_h - 1)
 
             #Coordinate point added to curve list
-            if self.mode == "start":
-                self.start_curve.append((x, y))
-            elif self.mode == "stop":
-                self.stop_curve.append((x, y))
+            self.curves[self.active].append((x, y))
 
             self.update()
+        elif event.button() in (Qt.RightButton, Qt.MiddleButton):
+            self.start_drag(event)
+
+    def mouseMoveEvent(self, event):
+        self.drag_to(event)
+
+    def mouseReleaseEvent(self, event):
+        self.end_drag()
 
     def paintEvent(self, event):
         """
-        Draw start (red) and stop (blue) curves on pixmap (display)
+        Draw start (red), middle (green) and stop (blue) curves on the visible image
         """
         painter = QPainter(self)
-        if self.pixmap:
-            painter.drawPixmap(0, 0, self.pixmap)
-        start_pen = QPen(Qt.red, 2)
-        stop_pen = QPen(Qt.blue, 2)
-
-        if len(self.start_curve) > 1:
-            painter.setPen(start_pen)
-            for i in range(1, len(self.start_curve)):
-                p1 = self.to_display_coords(self.start_curve[i-1])
-                p2 = self.to_display_coords(self.start_curve[i])
-                painter.drawLine(p1, p2)
-        if len(self.stop_curve) > 1:
-            painter.setPen(stop_pen)
-            for i in range(1, len(self.stop_curve)):
-                p1 = self.to_display_coords(self.stop_curve[i-1])
-                p2 = self.to_display_coords(self.stop_curve[i])
+        self.paint_image(painter)
+        if self.pyramid is None:
+            return
+
+        last = len(self.curves) - 1
+        for i, curve in enumerate(self.curves):
+            if len(curve) < 2:
+                continue
+            color = START_COLOR if i == 0 else STOP_COLOR if i == last else MIDDLE_COLOR
+            painter.setPen(QPen(color, 3 if i == self.active else 2))
+            for j in range(1, len(curve)):
+                p1 = self.to_display_coords(curve[j-1])
+                p2 = self.to_display_coords(curve[j])
                 painter.drawLine(p1, p2)
 
     def to_display_coords(self, point):
@@ -86,12 +131,4 @@ class CurveDrawingWidget(QWidget):
         Convert original image coordinates to display coordinates
         """
         x, y = point
-        scale_x = self.pixmap.width() / self.orig_w
-        scale_y = self.pixmap.height() / self.orig_h
-        return QPoint(int(x * scale_x), int(y * scale_y))
-
-
-
-
-
-
+        return self.to_screen(x, y)
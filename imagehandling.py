@@ -1,7 +1,265 @@
+import copy
+import math
 import os
-from PySide6.QtWidgets import QFileDialog, QMessageBox
-import cv2 as cv
-import tifffile as tiff
+import threading
+
+import numpy as np
+
+# cv2 and tifffile are imported where used, so headless workers and the GUI
+# start without loading decoders they may never need
+
+
+class TiffImage:
+    def __init__(self, path, channel=None, page=0, level=0, series=0):
+        """
+        Lazily opened TIFF image indexed as (Y, X) or (Y, X, channel)
+        shape and dtype are read from the file header; pixels are read only when
+        indexed, and only for the chosen channel, page (flat index over any
+        Z/T/I axes) and pyramid level
+        """
+        import tifffile as tiff
+
+        self.path = path
+        self.key = (series, level, page, channel)  # selects the pixels read from path
+        with tiff.TiffFile(path) as tif:
+            level_series = tif.series[series].levels[level]
+            axes, shape = level_series.axes, level_series.shape
+            self.dtype = level_series.dtype
+
+        # --- Fixed index into the file axes ---
+        self._page_axes = [i for i, ax in enumerate(axes) if ax not in "YXSC"]
+        self._page_shape = [shape[i] for i in self._page_axes]
+        self.pages = int(np.prod(self._page_shape))  # Z/T/I planes
+        self._index = [slice(None)] * len(axes)
+        self._set_page(page)
+
+        # File axes that remain, in output order Y, X(, channel)
+        self._out_axes = [axes.index("Y"), axes.index("X")]
+        ch_axes = [i for i, ax in enumerate(axes) if ax in "SC"]
+        for i in ch_axes[1:]:
+            self._index[i] = 0
+        if ch_axes:
+            if channel is None:
+                self._out_axes.append(ch_axes[0])
+            else:
+                self._index[ch_axes[0]] = channel
+        self.shape = tuple(shape[i] for i in self._out_axes)
+
+        # --- Pixel source: memory map, chunked zarr view or decode on first use ---
+        # Shared with the images plane() returns, so a stack is opened once
+        self._source = None
+        self._decoded = {}  # "full": whole series, decoded on first use
+        try:
+            self._source = tiff.memmap(path, series=series, level=level, mode="r")
+        except ValueError:
+            # Compressed or tiled data can't be memory-mapped
+            try:
+                import zarr
+                with tiff.TiffFile(path) as tif:
+                    store = tif.series[series].aszarr(level=level)
+                self._source = zarr.open(store, mode="r")
+            except ImportError:
+                self._series, self._level = series, level
+
+    def _set_page(self, page):
+        page_index = np.unravel_index(page, self._page_shape) if self._page_axes else ()
+        for i, p in zip(self._page_axes, page_index):
+            self._index[i] = int(p)
+        self.key = self.key[:2] + (page,) + self.key[3:]
+
+    def plane(self, page):
+        """
+        Returns the image of another page (plane) of the same file, reading
+        from this image's memory map, zarr store or decoded series instead of
+        opening and parsing the file again
+        """
+        if not 0 <= page < self.pages:
+            raise IndexError(f"Plane {page} out of range for {self.pages} planes")
+        other = copy.copy(self)
+        other._index = list(self._index)
+        other._set_page(page)
+        return other
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __getitem__(self, key):
+        """
+        Reads the region selected by key (ints and slices over output axes)
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > self.ndim:
+            raise IndexError(f"Too many indices for image of shape {self.shape}")
+
+        index = list(self._index)
+        kept = []
+        for pos, axis in enumerate(self._out_axes):
+            k = key[pos] if pos < len(key) else slice(None)
+            index[axis] = k
+            if not isinstance(k, (int, np.integer)):
+                kept.append(axis)
+
+        source = self._source
+        if source is None:
+            # Without zarr, compressed files are decoded once for all planes
+            if "full" not in self._decoded:
+                import tifffile as tiff
+                self._decoded["full"] = tiff.imread(self.path, series=self._series,
+                                                    level=self._level)
+            source = self._decoded["full"]
+
+        region = np.asarray(source[tuple(index)])
+        return np.ascontiguousarray(self._to_output_order(region, kept))
+
+    @staticmethod
+    def _to_output_order(region, axes):
+        """
+        Region holds the given file axes in file order; reorder them as listed
+        """
+        order = sorted(axes)
+        return region.transpose([order.index(axis) for axis in axes])
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self[()]
+        return arr if dtype is None else arr.astype(dtype)
+
+
+class ImageLoader:
+    def __init__(self, path, thumb_side: int = 512, strip: int = 1024, projection="max"):
+        """
+        Loads an image piece by piece so it can run on a worker thread with
+        progress reports, an early thumbnail and cancellation between pieces
+        TIFFs are read strip by strip (from a memory map or chunk store where
+        possible); stacks are projected plane by plane ("max" or "mean");
+        other formats are decoded by OpenCV in one go
+        """
+        self.path = path
+        self.thumb_side = thumb_side
+        self.strip = strip
+        self.projection = projection
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """Stops loading before the next strip; run() then returns None"""
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def run(self, progress=None):
+        """
+        progress(event) is called with ("fraction", 0..1) as data arrives and
+        ("thumbnail", (array, k, complete)) when a copy downsampled by 2**k is
+        available; incomplete thumbnails are filled from the top as strips arrive
+        Returns the image as ImageHandling.load_path would, or None if cancelled
+        Raises ValueError if the file can't be read
+        """
+        report = progress or (lambda event: None)
+        ext = os.path.splitext(self.path)[1].lower()
+        if ext in ('.tif', '.tiff'):
+            return self._run_tiff(report)
+        return self._run_opencv(report, ext)
+
+    def _run_opencv(self, report, ext):
+        import cv2 as cv
+
+        # JPEG decodes at 1/8 size for a fraction of the full decode cost
+        thumb = None
+        if ext in ('.jpg', '.jpeg'):
+            thumb = cv.imread(self.path, cv.IMREAD_REDUCED_COLOR_8)
+            if thumb is not None:
+                report(("thumbnail", (thumb, 3, True)))
+        if self.cancelled:
+            return None
+
+        img = cv.imread(self.path)
+        if img is None:
+            raise ValueError("Could not load image file")
+        report(("fraction", 1.0))
+        if thumb is None:
+            report(("thumbnail", (img, 0, True)))
+        return img
+
+    def _run_tiff(self, report):
+        import cv2 as cv
+
+        try:
+            src = TiffImage(self.path)
+        except Exception as e:
+            raise ValueError(f"Could not load image file: {e}")
+        if src.pages > 1:
+            return self._run_stack(report, src.pages)
+        h, w = src.shape[:2]
+
+        # A pyramid level stored in the file gives the thumbnail before any full resolution pixel
+        thumb = self._stored_thumbnail(w)
+        if thumb is not None:
+            report(("thumbnail", thumb))
+        k = math.ceil(math.log2(max(h, w) / self.thumb_side)) if max(h, w) > self.thumb_side else 0
+        f = 2 ** k
+        small = None
+        if thumb is None and h >= f and w >= f:
+            small = np.zeros((h // f, w // f) + src.shape[2:], dtype=src.dtype)
+
+        img = np.empty(src.shape, dtype=src.dtype)
+        strip = -(-max(self.strip, f) // f) * f  # multiple of 2**k
+        next_report = 0.1
+        for y in range(0, h, strip):
+            if self.cancelled:
+                return None
+            y1 = min(y + strip, h)
+            img[y:y1] = src[y:y1]
+
+            if small is not None:
+                rows = (y1 - y) // f
+                if rows:
+                    block = img[y:y + rows * f, :small.shape[1] * f]
+                    small[y // f:y // f + rows] = cv.resize(block, (small.shape[1], rows),
+                                                           interpolation=cv.INTER_AREA)
+                if y1 / h >= next_report and y1 < h:
+                    report(("thumbnail", (small.copy(), k, False)))
+                    next_report += 0.1
+            report(("fraction", y1 / h))
+
+        if thumb is None:
+            report(("thumbnail", (small, k, True) if small is not None else (img, 0, True)))
+        return img
+
+    def _run_stack(self, report, pages):
+        from zstack import StackReader, project
+
+        def planes():
+            for i, plane in enumerate(StackReader(self.path)):
+                yield plane
+                report(("fraction", (i + 1) / pages))
+                if self.cancelled:
+                    return
+
+        img = project(planes(), self.projection)
+        if self.cancelled:
+            return None
+        report(("thumbnail", (img, 0, True)))
+        return img
+
+    def _stored_thumbnail(self, width):
+        """
+        Returns (array, k, True) of the finest stored pyramid level that is
+        at most twice thumb_side and 2**k times smaller than the image, or None
+        """
+        import tifffile as tiff
+
+        with tiff.TiffFile(self.path) as tif:
+            n_levels = len(tif.series[0].levels)
+        for level in range(1, n_levels):
+            src = TiffImage(self.path, level=level)
+            factor = width / src.shape[1]
+            k = int(round(math.log2(factor)))
+            if max(src.shape[:2]) <= 2 * self.thumb_side and abs(factor - 2 ** k) < 0.1 * 2 ** k:
+                return src[()], k, True
+        return None
 
 
 class ImageHandling:
@@ -11,36 +269,47 @@ class ImageHandling:
         self.filename = None
         self.ext = None
 
-    def load_file(self, parent):
+    def set_loaded(self, path, img):
+        """Stores an image loaded elsewhere, e.g. by ImageLoader on a worker thread"""
+        self.ext = os.path.splitext(path)[1].lower()
+        self.file_path = path
+        self.filename = os.path.basename(path)
+        self.loaded_image = img
+
+    def load_path(self, path, lazy=False, channel=None, page=0, level=0, projection=None):
         """
-        User chooses image file (.jpg, .jpeg, .png, .tif, .tiff)
-        Image loaded with Tifffile or OpenCV imread
+        Loads image (.jpg, .jpeg, .png, .tif, .tiff) with Tifffile or OpenCV imread
+        lazy: TIFFs are opened as TiffImage, which only reads the requested
+        channel/page/level when indexed, instead of decoding the file into RAM
+        Stacks (multi-page TIFFs, Z/T axes) give the plane at page, or with
+        projection ("max" or "mean") the projection of all planes, streamed
+        plane by plane
+        Returns False if the image could not be loaded
         """
-        # Choosing image
-        path, _ = QFileDialog.getOpenFileName(parent,
-            "Choose image file",
-            filter="Images (*.jpg *.jpeg *.png *.tif *.tiff)")
-
-        if not path:
-            self.file_path = None
-            return False
-
         self.ext = os.path.splitext(path)[1].lower()
         self.file_path = path
         self.filename = os.path.basename(path)
 
         # Loading image
         if self.ext in ('.tif', '.tiff'):
-            self.loaded_image = tiff.imread(self.file_path)
+            image = TiffImage(path, channel=channel, page=page, level=level)
+            if projection is not None and image.pages > 1:
+                from zstack import StackReader, project
+                self.loaded_image = project(StackReader(path, channel=channel, level=level),
+                                            projection)
+            elif lazy:
+                self.loaded_image = image
+            else:
+                # Read through TiffImage so eager and lazy loads agree on
+                # axis order (Y, X, C), channel, page and level
+                self.loaded_image = np.ascontiguousarray(image[()])
         else:
-            self.loaded_image = cv.imread(self.file_path)
+            import cv2 as cv
+            self.loaded_image = cv.imread(path)
+            if self.loaded_image is not None and channel is not None:
+                self.loaded_image = self.loaded_image[:, :, channel].copy()
 
         if self.loaded_image is None:
-            QMessageBox.critical(
-                parent,
-                "Error",
-                "Could not load image file"
-            )
             self.file_path = None
             return False
 
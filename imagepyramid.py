@@ -0,0 +1,84 @@
+import math
+import threading
+
+import cv2 as cv
+import numpy as np
+
+
+class ImagePyramid:
+    def __init__(self, img, min_side: int = 256, strip: int = 1024):
+        """
+        Levels of img halved in size until the longest side is at most min_side
+        Level k pixel (x, y) covers level 0 pixels (x * 2**k, y * 2**k) to
+        ((x + 1) * 2**k, (y + 1) * 2**k). Levels are built on first use, one
+        strip of rows at a time, so lazy images are never read all at once and
+        building can also run on a worker thread (see build)
+        """
+        self.shape = tuple(img.shape)  # of level 0
+        self.strip = strip
+        h, w = self.shape[:2]
+        self.max_level = max(0, math.ceil(math.log2(max(h, w) / min_side))) if max(h, w) > min_side else 0
+        self.min_level = 0  # finest level available
+        self._levels = {0: img}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_level(cls, img, k, shape, min_side: int = 256):
+        """
+        Pyramid of an image (full size shape) of which only level k, img, is
+        available yet, e.g. a thumbnail shown while the image is still loading
+        Finer levels are not available: views are drawn from level k
+        """
+        pyramid = cls(img, min_side)
+        pyramid.shape = tuple(shape)
+        h, w = pyramid.shape[:2]
+        pyramid.max_level = max(k, math.ceil(math.log2(max(h, w) / min_side)) if max(h, w) > min_side else 0)
+        pyramid.min_level = k
+        pyramid._levels = {k: img}
+        return pyramid
+
+    @property
+    def dtype(self):
+        return self._levels[self.min_level].dtype
+
+    def level_for_scale(self, scale):
+        """
+        Returns the smallest level that still has at least one pixel per
+        screen pixel at scale (screen pixels per level 0 pixel)
+        """
+        k = 0 if scale >= 1 else int(math.floor(math.log2(1 / scale)))
+        return min(max(k, self.min_level), self.max_level)
+
+    def level(self, k):
+        """Returns level k as an array (level 0 is the image itself)"""
+        k = min(max(k, self.min_level), self.max_level)
+        with self._lock:
+            finest = max(j for j in self._levels if j <= k)
+            for j in range(finest, k):
+                self._levels[j + 1] = self._halve(self._levels[j])
+            return self._levels[k]
+
+    def build(self, upto=None):
+        """
+        Builds all levels up to upto (default: all); ZoomPanView.set_image runs
+        it on a worker thread for large images
+        """
+        self.level(self.max_level if upto is None else upto)
+
+    def is_built(self, k):
+        return k in self._levels
+
+    def region(self, k, x0, y0, x1, y1):
+        """Returns contiguous array of level k inside box (level k coordinates)"""
+        return np.ascontiguousarray(self.level(k)[y0:y1, x0:x1])
+
+    def _halve(self, src):
+        """2 x 2 box average of src, strip by strip; an odd last row/column is dropped"""
+        h, w = src.shape[:2]
+        out_h, out_w = max(h // 2, 1), max(w // 2, 1)
+        out = np.empty((out_h, out_w) + tuple(src.shape[2:]), dtype=src.dtype)
+        for y in range(0, out_h, self.strip // 2):
+            rows = min(self.strip // 2, out_h - y)
+            block = np.ascontiguousarray(src[2 * y:2 * (y + rows), :2 * out_w])
+            out[y:y + rows] = cv.resize(block, (out_w, rows), interpolation=cv.INTER_AREA)
+        return out
@@ -1,10 +1,15 @@
+import numpy as np
+from PySide6.QtCore import Qt, QThreadPool
+from PySide6.QtGui import QImage, QPixmap
 from PySide6.QtWidgets import ( QWidget, QMainWindow, QHBoxLayout,
-                                QVBoxLayout, QPushButton, QLabel)
+                                QVBoxLayout, QPushButton, QLabel,
+                                QFileDialog, QMessageBox, QProgressBar)
 
 from infobutton import InfoButton
-from imagehandling import ImageHandling
-from maskgeneratorwindow import MaskGeneratorWindow
-from cellcountwindow import CellCountWindow
+from imagehandling import ImageHandling, ImageLoader
+from worker import Worker
+# MaskGeneratorWindow and CellCountWindow (and with them OpenCV) are imported
+# when first opened, so the main window shows without loading them
 
 
 class MainWindow(QMainWindow):
@@ -14,6 +19,13 @@ class MainWindow(QMainWindow):
         self.setWindowTitle("Load Image")
         self.images = ImageHandling()
 
+        # --- Background loading state ---
+        self.pool = QThreadPool.globalInstance()
+        self.loader = None     # ImageLoader of the file being loaded
+        self.load_signals = None  # signals of its worker; others are stale
+        self.thumbnail = None  # (array, k) downsampled by 2**k, once complete
+        self.mask_window = None
+
         # --- Layout structure ---
         container = QWidget()
         layout = QVBoxLayout(container)
@@ -21,6 +33,9 @@ class MainWindow(QMainWindow):
         # Top row: load image controls
         inner_container1 = QWidget()
         inner_layout1 = QHBoxLayout(inner_container1)
+        # Loading progress and thumbnail
+        progress_container = QWidget()
+        progress_layout = QHBoxLayout(progress_container)
         # Middle row: mask generation
         inner_container2 = QWidget()
         inner_layout2 = QHBoxLayout(inner_container2)
@@ -40,6 +55,20 @@ class MainWindow(QMainWindow):
         self.load_button.clicked.connect(self.load_file)
         self.load_label = QLabel("No Image Loaded")
 
+        # --- Loading progress controls ---
+        self.load_progress = QProgressBar()
+        self.load_progress.setRange(0, 100)
+        self.load_progress.setFixedHeight(15)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setFixedSize(100, 25)
+        self.cancel_button.clicked.connect(self.cancel_load)
+        progress_container.hide()
+        self.progress_container = progress_container
+        self.thumbnail_label = QLabel()
+        self.thumbnail_label.setFixedSize(200, 200)
+        self.thumbnail_label.setAlignment(Qt.AlignCenter)
+        self.thumbnail_label.hide()
+
         # --- Generate mask controls ---
         mask_info = InfoButton("Optional. Click here to \n" 
                                "define area where cells \n"
@@ -47,7 +76,7 @@ class MainWindow(QMainWindow):
         self.mask_button = QPushButton("Generate Mask")
         self.mask_button.setFixedSize(100, 25)
         self.mask_button.clicked.connect(self.generate_mask)
-        self.mask_button.setEnabled(False) # disabled until image is loaded
+        self.mask_button.setEnabled(False) # disabled until a thumbnail is loaded
 
         # --- Cell count controls ---
         count_info = InfoButton("Click here to begin cell\n" 
@@ -62,12 +91,16 @@ class MainWindow(QMainWindow):
         inner_layout1.addWidget(load_info)
         inner_layout1.addWidget(self.load_button)
         inner_layout1.addWidget(self.load_label)
+        progress_layout.addWidget(self.load_progress)
+        progress_layout.addWidget(self.cancel_button)
         inner_layout2.addWidget(mask_info)
         inner_layout2.addWidget(self.mask_button)
         inner_layout3.addWidget(count_info)
         inner_layout3.addWidget(self.analyze_button)
         # Widgets added top to bottom
         layout.addWidget(inner_container1)
+        layout.addWidget(progress_container)
+        layout.addWidget(self.thumbnail_label)
         layout.addWidget(inner_container2)
         layout.addWidget(inner_container3)
 
@@ -75,18 +108,142 @@ class MainWindow(QMainWindow):
 
     def load_file(self):
         """
-        Load image with ImageHandling, enables mask generation and cell counting
+        User chooses image file (.jpg, .jpeg, .png, .tif, .tiff)
+        Image is loaded on a background thread, see start_load
+        """
+        # Choosing image
+        path, _ = QFileDialog.getOpenFileName(self,
+            "Choose image file",
+            filter="Images (*.jpg *.jpeg *.png *.tif *.tiff)")
+
+        if not path:
+            return
+        self.start_load(path)
+
+    def start_load(self, path):
+        """
+        Loads image with ImageLoader on a worker thread
+        Shows progress and thumbnail; mask generation is enabled once a
+        thumbnail is complete, cell counting once the full image is loaded
+        """
+        if self.loader is not None:
+            self.loader.cancel()
+        loader = ImageLoader(path)
+        self.loader = loader
+        self.thumbnail = None
+        self.images = ImageHandling()
+
+        worker = Worker(loader.run)
+        worker.kwargs["progress"] = worker.signals.progress.emit
+        worker.signals.progress.connect(self.load_progressed)
+        worker.signals.finished.connect(self.load_done)
+        worker.signals.failed.connect(self.load_failed)
+        self.load_signals = worker.signals
+
+        self.load_label.setText(f"Loading {path.replace(chr(92), '/').split('/')[-1]}...")
+        self.load_progress.setValue(0)
+        self.progress_container.show()
+        self.thumbnail_label.clear()
+        self.mask_button.setEnabled(False)
+        self.analyze_button.setEnabled(False)
+        self.pool.start(worker)
+
+    def is_stale(self):
+        """True if the emitting worker belongs to a replaced or finished load"""
+        return self.loader is None or self.sender() is not self.load_signals
+
+    def load_progressed(self, event):
+        """
+        Updates progress bar and thumbnail while loading
         """
-        if self.images.load_file(self):
-            self.load_label.setText(f"{self.images.filename} Loaded")
-            self.mask_button.setEnabled(True)
-            self.analyze_button.setEnabled(True)
+        if self.is_stale():
+            return
+        kind, value = event
+        if kind == "fraction":
+            self.load_progress.setValue(int(value * 100))
+        elif kind == "thumbnail":
+            thumb, k, complete = value
+            self.show_thumbnail(thumb, rgb=self.loader.path.lower().endswith(('.tif', '.tiff')))
+            if complete:
+                self.thumbnail = (thumb, k)
+                self.mask_button.setEnabled(True)
+
+    def load_done(self, img):
+        """
+        Stores loaded image, enables cell counting and hands the image to an
+        already opened mask window
+        """
+        if self.is_stale():
+            return
+        path = self.loader.path
+        self.loader = None
+        self.progress_container.hide()
+        if img is None:
+            self.load_label.setText("Loading cancelled")
+            self.thumbnail_label.hide()
+            self.mask_button.setEnabled(False)
+            return
+
+        self.images.set_loaded(path, img)
+        self.load_label.setText(f"{self.images.filename} Loaded")
+        self.mask_button.setEnabled(True)
+        self.analyze_button.setEnabled(True)
+        if self.mask_window is not None:
+            self.mask_window.set_image(img)
+
+    def load_failed(self, message):
+        if self.is_stale():
+            return
+        self.loader = None
+        self.progress_container.hide()
+        self.thumbnail_label.hide()
+        self.load_label.setText("No Image Loaded")
+        self.mask_button.setEnabled(False)
+        QMessageBox.critical(
+            self,
+            "Error",
+            message
+        )
+
+    def cancel_load(self):
+        """Stops loading the current file"""
+        if self.loader is not None:
+            self.loader.cancel()
+
+    def show_thumbnail(self, thumb, rgb):
+        """
+        input: thumbnail array (any bit depth, grayscale, BGR or RGB if rgb)
+        """
+        import cv2 as cv
+
+        if thumb.dtype != np.uint8:
+            thumb = cv.normalize(thumb, None, 0, 255, cv.NORM_MINMAX).astype(np.uint8)
+        thumb = np.ascontiguousarray(thumb)
+        h, w = thumb.shape[:2]
+        if thumb.ndim == 2:
+            fmt = QImage.Format_Grayscale8
+        else:
+            fmt = QImage.Format_RGB888 if rgb else QImage.Format_BGR888
+        pixmap = QPixmap.fromImage(QImage(thumb.data, w, h, thumb.strides[0], fmt))
+        self.thumbnail_label.setPixmap(pixmap.scaled(self.thumbnail_label.size(), Qt.KeepAspectRatio,
+                                                     Qt.SmoothTransformation))
+        self.thumbnail_label.show()
 
     def generate_mask(self):
         """
         Opens MaskGeneratorWindow for optional mask generation and closes MainWindow
         """
-        self.mask_window = MaskGeneratorWindow(self.images.loaded_image)
+        from maskgeneratorwindow import MaskGeneratorWindow
+
+        if self.images.loaded_image is not None:
+            self.mask_window = MaskGeneratorWindow(self.images.loaded_image)
+        else:
+            # Still loading: curves are drawn on the thumbnail, the full image
+            # is handed over by load_done
+            from imagepyramid import ImagePyramid
+            thumb, k = self.thumbnail
+            shape = (thumb.shape[0] << k, thumb.shape[1] << k) + thumb.shape[2:]
+            self.mask_window = MaskGeneratorWindow(None, ImagePyramid.from_level(thumb, k, shape))
         self.mask_window.show()
         self.close()
 
@@ -95,6 +252,8 @@ class MainWindow(QMainWindow):
         """
         Opens CellAnalysisWindow with loaded image as input and closes MainWindow
         """
+        from cellcountwindow import CellCountWindow
+
         self.analysis_window = CellCountWindow(self.images.loaded_image)
         self.analysis_window.show()
         self.close()
@@ -1,28 +1,94 @@
+from functools import cached_property
+
 import numpy as np
 import cv2 as cv
 
 class MaskGenerator:
-    def __init__(self, img, start_curve, stop_curve):
+    def __init__(self, img, start_curve, stop_curve, margin=32, middle_curves=()):
         self.img = img
         self.start_curve = start_curve
         self.stop_curve = stop_curve
-
-        # =========================
-        # Build mask
-        # =========================
-        H, W = self.img.shape[:2]
-        self.mask = np.zeros((H, W), dtype=np.uint8)
+        self.margin = margin  # processing margin around the polygon's bounding box
+        # Curves in order from start to stop; consecutive curves bound one band
+        self.curves = [start_curve, *middle_curves, stop_curve]
 
         # Build polygon:
         # top curve left→right
         # bottom curve right→left
         polygon = start_curve + stop_curve[::-1]
-        polygon = np.array(polygon, dtype=np.int32)
+        self.polygon = np.array(polygon, dtype=np.int32)
+
+    @cached_property
+    def bands(self):
+        """
+        Polygon of every band between consecutive curves (N curves, N - 1 bands)
+        Their union is polygon, so CellCount.bands splits the region's count
+        """
+        return [np.array(a + b[::-1], dtype=np.int32)
+                for a, b in zip(self.curves, self.curves[1:])]
+
+    @cached_property
+    def named_curves(self):
+        """
+        {name: curve} of the start, middle (line1, line2, ...) and stop curves,
+        the lines CellCount.curves measures every cell's distance to
+        """
+        names = ["start", *(f"line{i}" for i in range(1, len(self.curves) - 1)), "stop"]
+        return dict(zip(names, self.curves))
 
-        cv.fillPoly(self.mask, [polygon], 255)
+    # mask and masked are full-size images, so they are only built when used;
+    # CellCount.region only needs the polygon and CellCount.roi the bbox
 
+    @cached_property
+    def mask(self):
+        # =========================
+        # Build mask
+        # =========================
+        H, W = self.img.shape[:2]
+        mask = np.zeros((H, W), dtype=np.uint8)
+        cv.fillPoly(mask, [self.polygon], 255)
+        return mask
+
+    @cached_property
+    def masked(self):
         # =========================
         # Apply mask
         # =========================
-        self.masked = cv.bitwise_and(self.img, self.img, mask=self.mask)
+        return cv.bitwise_and(self.img, self.img, mask=self.mask)
+
+    # =========================
+    # Cropped ROI
+    # =========================
+    # Polygon bounding box plus margin; everything outside it is zero in
+    # masked, so the pipeline only needs to see this part of the image
+
+    @cached_property
+    def bbox(self):
+        """(x0, y0, x1, y1) of polygon plus margin, clipped to the image"""
+        H, W = self.img.shape[:2]
+        x0, y0 = self.polygon.min(axis=0) - self.margin
+        x1, y1 = self.polygon.max(axis=0) + 1 + self.margin
+        return (int(max(x0, 0)), int(max(y0, 0)), int(min(x1, W)), int(min(y1, H)))
+
+    @property
+    def offset(self):
+        """(x, y) to add to ROI coordinates to get image coordinates"""
+        return self.bbox[0], self.bbox[1]
+
+    @cached_property
+    def roi(self):
+        """View of img inside bbox (no copy)"""
+        x0, y0, x1, y1 = self.bbox
+        return self.img[y0:y1, x0:x1]
+
+    @cached_property
+    def roi_mask(self):
+        x0, y0, x1, y1 = self.bbox
+        mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        cv.fillPoly(mask, [self.polygon - self.offset], 255)
+        return mask
 
+    @cached_property
+    def roi_masked(self):
+        roi = np.ascontiguousarray(self.roi)
+        return cv.bitwise_and(roi, roi, mask=self.roi_mask)
@@ -1,17 +1,23 @@
 from PySide6.QtWidgets import (QMainWindow,
                                QWidget, QVBoxLayout,
-                               QHBoxLayout, QPushButton)
+                               QHBoxLayout, QPushButton,
+                               QCheckBox)
 
 from curvedrawingwidget import CurveDrawingWidget
 from infobutton import InfoButton
 from maskgenerator import MaskGenerator
-from cellcountwindow import CellCountWindow
 
 
 class MaskGeneratorWindow(QMainWindow):
-    def __init__(self, img):
+    def __init__(self, img, pyramid=None):
+        """
+        img: image to draw the mask on, or None while it is still loading;
+        curves are then drawn on pyramid (the thumbnail) and OK is enabled
+        once set_image hands over the full image
+        """
         super().__init__()
         self.img = img
+        self.analysis = None
 
         self.setWindowTitle("Mask Generator Window")
 
@@ -22,17 +28,19 @@ class MaskGeneratorWindow(QMainWindow):
         # Info button column
         info_container = QWidget()
         info_layout = QVBoxLayout(info_container)
-        info_container.setFixedSize(30, 150)
+        info_container.setFixedSize(30, 270)
         # Pushbutton column
         button_container = QWidget()
         button_layout = QVBoxLayout(button_container)
-        button_container.setFixedSize(250, 150)
+        button_container.setFixedSize(250, 270)
 
         # --- Start line controls ---
         self.start_info = InfoButton("Click on image to \n"
                                      "draw line from which\n"
                                      "cell counting should\n"
-                                     "start.")
+                                     "start.\n"
+                                     "Scroll to zoom, drag\n"
+                                     "with right button to pan.")
         self.start_button = QPushButton("Start Line")
         self.start_button.setFixedSize(100, 25)
         self.start_button.clicked.connect(lambda: self.set_mode("start"))
@@ -46,6 +54,34 @@ class MaskGeneratorWindow(QMainWindow):
         self.stop_button.setFixedSize(100, 25)
         self.stop_button.clicked.connect(lambda: self.set_mode("stop"))
 
+        # --- Band line controls ---
+        self.band_info = InfoButton("Optional. Click here to \n"
+                                    "draw another line between\n"
+                                    "start and stop line. Cells\n"
+                                    "are then also counted per\n"
+                                    "band between lines.")
+        self.band_button = QPushButton("Add Line")
+        self.band_button.setFixedSize(100, 25)
+        self.band_button.clicked.connect(self.add_line)
+
+        # --- Clear controls ---
+        self.clear_info = InfoButton("Click here to remove\n"
+                                     "both lines and draw\n"
+                                     "them again.")
+        self.clear_button = QPushButton("Clear Lines")
+        self.clear_button.setFixedSize(100, 25)
+        self.clear_button.clicked.connect(self.clear)
+
+        # --- Region mode controls ---
+        self.region_info = InfoButton("Segment the whole image\n"
+                                      "once and count cells whose\n"
+                                      "centre lies between the\n"
+                                      "lines. Lines can then be\n"
+                                      "redrawn and counted again\n"
+                                      "instantly.")
+        self.region_check = QCheckBox("Keep lines editable")
+        self.region_check.setChecked(True)
+
         # --- Done controls ---
         self.done_info = InfoButton("Click here when \n"
                                          "you are satisfied\n"
@@ -53,16 +89,23 @@ class MaskGeneratorWindow(QMainWindow):
         self.done_button = QPushButton("OK")
         self.done_button.setFixedSize(100, 25)
         self.done_button.clicked.connect(self.done)
+        self.done_button.setEnabled(img is not None)
 
         # --- Curve drawing widget ---
-        self.curve_drawer = CurveDrawingWidget(img)
+        self.curve_drawer = CurveDrawingWidget(img, pyramid)
 
         # Widgets added top to bottom
         info_layout.addWidget(self.start_info)
         info_layout.addWidget(self.stop_info)
+        info_layout.addWidget(self.band_info)
+        info_layout.addWidget(self.clear_info)
+        info_layout.addWidget(self.region_info)
         info_layout.addWidget(self.done_info)
         button_layout.addWidget(self.start_button)
         button_layout.addWidget(self.stop_button)
+        button_layout.addWidget(self.band_button)
+        button_layout.addWidget(self.clear_button)
+        button_layout.addWidget(self.region_check)
         button_layout.addWidget(self.done_button)
         # Widgets added left to right
         main_layout.addWidget(info_container)
@@ -71,22 +114,63 @@ class MaskGeneratorWindow(QMainWindow):
 
         self.setCentralWidget(main_container)
 
+    def set_image(self, img):
+        """
+        Replaces the thumbnail with the fully loaded image; drawn curves are
+        kept since both share original image coordinates
+        """
+        self.img = img
+        self.curve_drawer.set_image(img)
+        self.done_button.setEnabled(True)
+
     def set_mode(self, mode):
         """
         Changes curve drawing mode (start or stop line)
         """
         self.curve_drawer.mode = mode
 
+    def add_line(self):
+        """
+        Starts a new curve between the start and stop curve
+        """
+        self.curve_drawer.add_curve()
+
+    def clear(self):
+        """
+        Removes all curves
+        """
+        self.curve_drawer.clear_curves()
+
     def done(self):
         """
         Generates mask between curves using MaskGenerator.
-        Calls CellCountWindow with masked_image
+        Region mode: CellCountWindow counts cells of the full image inside the
+        mask polygon and stays linked, so pressing OK again re-counts instantly.
+        Otherwise CellCountWindow only segments the polygon's bounding box (plus
+        margin) and counts the cells inside the polygon
         """
         if len(self.curve_drawer.start_curve) < 2 or len(self.curve_drawer.stop_curve) < 2:
             return # Not enough points to generate mask
+        # Middle curves with fewer than 2 points are ignored
+        middle = [c for c in self.curve_drawer.middle_curves if len(c) >= 2]
+
+        from cellcountwindow import CellCountWindow
+
+        generator = MaskGenerator(self.img, self.curve_drawer.start_curve, self.curve_drawer.stop_curve,
+                                  middle_curves=middle)
+        # Bands only when there is more than the one between start and stop
+        bands = generator.bands if middle else None
+
+        if self.region_check.isChecked():
+            if self.analysis is not None and self.analysis.isVisible():
+                self.analysis.set_region(generator.polygon, bands, generator.named_curves)
+            else:
+                self.analysis = CellCountWindow(self.img, region=generator.polygon, bands=bands,
+                                                curves=generator.named_curves)
+                self.analysis.show()
+            return
 
-        generator = MaskGenerator(self.img, self.curve_drawer.start_curve, self.curve_drawer.stop_curve)
-        masked_image = generator.masked
-        self.analysis = CellCountWindow(masked_image)
+        self.analysis = CellCountWindow(self.img, region=generator.polygon, roi=generator.bbox,
+                                        bands=bands, curves=generator.named_curves)
         self.analysis.show()
         self.close()
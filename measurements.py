@@ -0,0 +1,251 @@
+import csv
+import os
+
+import numpy as np
+
+# Rows formatted per np.savetxt call when writing CSV
+CSV_CHUNK = 65536
+
+
+def label_blocks(labels, ids):
+    """
+    input: label image and ids of the cells
+    Yields (y0, y1, pos, rows) for row blocks labels[y0:y1] of about 1 Mpx:
+    flat positions within the block of the pixels labelled with one of the
+    ids and the index into ids of each, so per-cell sums are bincounts
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    h, w = labels.shape
+
+    # Label id -> row, -1 for labels not measured
+    lut = np.full(int(max(ids.max(), 0)) + 1 if ids.size else 1, -1, dtype=np.intp)
+    lut[ids] = np.arange(ids.size)
+
+    step = max(1, (1 << 20) // max(w, 1))
+    for y0 in range(0, h, step):
+        block = labels[y0:y0 + step]
+        pos = np.flatnonzero(block > 0)
+        lab = block.ravel()[pos]
+        keep = lab < len(lut)
+        pos, lab = pos[keep], lab[keep]
+        rows = lut[lab]
+        keep = rows >= 0
+        yield y0, y0 + len(block), pos[keep], rows[keep]
+
+
+def measure_cells(labels, ids, img, offset=(0, 0), curves=None):
+    """
+    input: label image (markers_ws), ids of the cells to measure, image the
+    labels were segmented from (2D or H x W x C, same height and width),
+    offset (x, y) of the label image in the full image and optional curves
+    {name: [(x, y), ...]} in full image coordinates
+    Returns dict of columns (numpy arrays, one row per id in order): cell
+    number, label, area, centroid, bounding box (x1, y1 exclusive), mean and
+    integrated intensity of every channel and distance from the centroid to
+    every curve. All sums come from one pass over the label image in row
+    blocks (label_blocks)
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    n = len(ids)
+    h, w = labels.shape
+    n_ch = 1 if img.ndim == 2 else img.shape[2]
+
+    area = np.zeros(n, dtype=np.int64)
+    sum_x = np.zeros(n)
+    sum_y = np.zeros(n)
+    sums = np.zeros((n_ch, n))
+    x0 = np.full(n, w, dtype=np.int64)
+    y0 = np.full(n, h, dtype=np.int64)
+    x1 = np.zeros(n, dtype=np.int64)
+    y1 = np.zeros(n, dtype=np.int64)
+
+    for by, ey, pos, rows in label_blocks(labels, ids):
+        ys, xs = np.divmod(pos, w)
+        ys += by
+
+        area += np.bincount(rows, minlength=n)
+        sum_x += np.bincount(rows, weights=xs, minlength=n)
+        sum_y += np.bincount(rows, weights=ys, minlength=n)
+        pixels = np.asarray(img[by:ey]).reshape(-1, n_ch)[pos]
+        for c in range(n_ch):
+            sums[c] += np.bincount(rows, weights=pixels[:, c], minlength=n)
+        np.minimum.at(x0, rows, xs)
+        np.minimum.at(y0, rows, ys)
+        np.maximum.at(x1, rows, xs + 1)
+        np.maximum.at(y1, rows, ys + 1)
+
+    ox, oy = offset
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cx = np.where(area > 0, sum_x / area, 0) + ox
+        cy = np.where(area > 0, sum_y / area, 0) + oy
+        means = np.where(area > 0, sums / area, 0)
+
+    columns = {
+        "cell": np.arange(1, n + 1),
+        "label": ids,
+        "area": area,
+        "cx": cx,
+        "cy": cy,
+        "bbox_x0": x0 + ox,
+        "bbox_y0": y0 + oy,
+        "bbox_x1": x1 + ox,
+        "bbox_y1": y1 + oy,
+    }
+    for c in range(n_ch):
+        columns[f"mean_ch{c}"] = means[c]
+        columns[f"integrated_ch{c}"] = sums[c]
+    for name, curve in (curves or {}).items():
+        columns[f"dist_{name}"] = polyline_distance(np.column_stack((cx, cy)), curve)
+    return columns
+
+
+def label_means(labels, ids, img, channels):
+    """
+    input: label image, ids of the cells, image the labels were segmented from
+    (2D or H x W x C) and the channels to measure
+    Returns (len(channels), len(ids)) array of the mean intensity of every
+    channel in every cell. Each row block of the image is read once for all
+    channels, like measure_cells
+    """
+    n = len(ids)
+    w = labels.shape[1]
+    channels = list(channels)
+
+    area = np.zeros(n, dtype=np.int64)
+    sums = np.zeros((len(channels), n))
+    for by, ey, pos, rows in label_blocks(labels, ids):
+        area += np.bincount(rows, minlength=n)
+        pixels = np.asarray(img[by:ey]).reshape((ey - by) * w, -1)[pos]
+        for i, c in enumerate(channels):
+            sums[i] += np.bincount(rows, weights=pixels[:, c], minlength=n)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(area > 0, sums / area, 0)
+
+
+def polyline_distance(points, curve, chunk: int = 1 << 22):
+    """
+    input: (N, 2) points and polyline [(x, y), ...]
+    Returns distance of every point to the nearest segment of the polyline,
+    computed for blocks of points so temporaries hold about chunk values
+    """
+    curve = np.asarray(curve, dtype=np.float64).reshape(-1, 2)
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(curve) == 0:
+        return np.full(len(points), np.nan)
+    if len(curve) == 1:
+        return np.hypot(*(points - curve[0]).T)
+
+    a, d = curve[:-1], np.diff(curve, axis=0)
+    length2 = np.maximum((d ** 2).sum(axis=1), np.finfo(float).tiny)
+    out = np.empty(len(points))
+    step = max(1, chunk // len(a))
+    for i in range(0, len(points), step):
+        p = points[i:i + step, None, :]
+        # Projection onto each segment, clamped to its end points
+        t = np.clip(((p - a) * d).sum(axis=2) / length2, 0.0, 1.0)
+        nearest = a + t[..., None] * d
+        out[i:i + step] = np.sqrt(((p - nearest) ** 2).sum(axis=2)).min(axis=1)
+    return out
+
+
+def to_arrow(columns, **constants):
+    """
+    Returns pyarrow Table of the columns (zero copy where dtypes allow) plus
+    a column per constant, e.g. path="image.tif", repeated for every row
+    """
+    import pyarrow as pa
+
+    n = len(next(iter(columns.values()))) if columns else 0
+    arrays = {name: pa.repeat(value, n) for name, value in constants.items()}
+    arrays.update((name, pa.array(values)) for name, values in columns.items())
+    return pa.table(arrays)
+
+
+class CellTableWriter:
+    def __init__(self, path):
+        """
+        Streams measurement tables to a .csv or .parquet file, one write() per
+        image; rows are formatted by numpy (CSV) or handed to Arrow as columns
+        (Parquet, needs pyarrow), never built as Python objects per cell
+        CSV files are appended to. A .parquet path is a dataset directory, each
+        writer adds a new part-<n>.parquet file to it, so earlier runs are kept;
+        read it whole with pyarrow.dataset or pandas.read_parquet
+        """
+        self.path = path
+        self.parquet = path.endswith(".parquet")
+        self.fieldnames = None
+        self._writer = None
+        if self.parquet:
+            import pyarrow  # noqa: F401  fail early if Parquet can't be written
+            if os.path.isfile(path):
+                raise ValueError(f"{path} is a file; Parquet cell tables are dataset directories")
+            os.makedirs(path, exist_ok=True)
+            self.part_path = self._next_part(path)
+            self.file = None
+        else:
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                with open(path, newline="") as f:
+                    self.fieldnames = next(csv.reader(f), None)
+            self.file = open(path, "a", newline="")
+
+    def write(self, columns, **constants):
+        """
+        Appends one table; constants (e.g. path=...) become leading columns
+        All tables must have the same columns
+        """
+        fieldnames = list(constants) + list(columns)
+        if self.fieldnames is None:
+            self.fieldnames = fieldnames
+            if not self.parquet:
+                csv.writer(self.file, lineterminator="\n").writerow(fieldnames)
+        elif fieldnames != self.fieldnames:
+            raise ValueError(f"Columns {fieldnames} differ from {self.fieldnames}")
+
+        if self.parquet:
+            import pyarrow.parquet as pq
+            table = to_arrow(columns, **constants)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.part_path, table.schema)
+            self._writer.write_table(table)
+            return
+
+        if not columns:
+            return
+        # Constants are written as literal text in the format of the first column
+        fmt = ["%d" if np.issubdtype(values.dtype, np.integer) else "%.10g"
+               for values in columns.values()]
+        fmt[0] = "".join(self._csv_field(value) + "," for value in constants.values()) + fmt[0]
+        n = len(next(iter(columns.values())))
+        for i in range(0, n, CSV_CHUNK):
+            block = np.column_stack([values[i:i + CSV_CHUNK] for values in columns.values()])
+            np.savetxt(self.file, block, fmt=fmt, delimiter=",")
+        self.file.flush()
+
+    @staticmethod
+    def _next_part(directory):
+        """Returns path of the first part-<n>.parquet not in directory, created empty"""
+        n = 0
+        while True:
+            part = os.path.join(directory, f"part-{n}.parquet")
+            try:
+                # Exclusive create claims the name, also against concurrent runs
+                with open(part, "x"):
+                    return part
+            except FileExistsError:
+                n += 1
+
+    @staticmethod
+    def _csv_field(value):
+        text = str(value)
+        if any(ch in text for ch in ',"\n\r'):
+            text = '"' + text.replace('"', '""') + '"'
+        return text.replace("%", "%%")
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        elif self.parquet:
+            os.remove(self.part_path)  # nothing written: no empty part in the dataset
+        if self.file is not None:
+            self.file.close()
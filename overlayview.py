@@ -0,0 +1,97 @@
+import numpy as np
+from PySide6.QtCore import Qt, QPointF
+from PySide6.QtGui import QColor, QFont, QImage, QPainter, QPen, QPolygonF
+
+from zoomview import ZoomPanView
+
+# Numbers are only drawn when at most this many cells are visible and each
+# has about NUMBER_AREA screen pixels; otherwise they overlap and only markers
+# are shown until the user zooms in
+MAX_NUMBERS = 1500
+NUMBER_AREA = 20 * 20
+
+
+class OverlayView(ZoomPanView):
+    def __init__(self, width, height):
+        """
+        Shows an image with cell markers, numbers and region outline drawn at
+        screen resolution, so drawing cost depends on what is visible rather
+        than on image size. Mouse wheel zooms, dragging pans, double-click resets
+        """
+        super().__init__(width, height)
+        self.centroids = np.zeros((0, 2))  # (x, y) in image coordinates
+        self.numbers = np.zeros(0, dtype=np.int64)
+        self.region = None  # polygon in image coordinates
+        self.bands = []  # band polygons in image coordinates
+        self._layer = None  # marker raster backing the last drawn QImage
+
+    def set_cells(self, centroids, region=None, bands=None):
+        """
+        input: (N, 2) array of cell centroids (x, y), optional region polygon
+        and band polygons, all in image coordinates; cells are numbered 1..N in order
+        """
+        self.centroids = np.asarray(centroids, dtype=np.float64).reshape(-1, 2)
+        self.numbers = np.arange(1, len(self.centroids) + 1)
+        self.region = None if region is None else np.asarray(region, dtype=np.float64).reshape(-1, 2)
+        self.bands = [np.asarray(b, dtype=np.float64).reshape(-1, 2) for b in bands or ()]
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        self.paint_image(painter)
+        if self.pyramid is None:
+            return
+
+        s = self._scale()
+        ox, oy = self._origin()
+
+        # --- Cell markers and numbers, visible cells only ---
+        pts = (self.centroids - (ox, oy)) * s
+        visible = ((pts[:, 0] >= 0) & (pts[:, 0] < self.width())
+                   & (pts[:, 1] >= 0) & (pts[:, 1] < self.height()))
+        pts = pts[visible]
+        painter.drawImage(0, 0, self._marker_layer(pts))
+
+        if 0 < len(pts) <= min(MAX_NUMBERS, self.width() * self.height() / NUMBER_AREA):
+            painter.setPen(QColor(255, 255, 0))
+            font = QFont()
+            font.setPixelSize(int(min(14, max(8, 4 * s))))
+            painter.setFont(font)
+            for (x, y), n in zip(pts.tolist(), self.numbers[visible].tolist()):
+                painter.drawText(QPointF(x + 2, y - 2), str(n))
+
+        # --- Band and region outlines ---
+        painter.setPen(QPen(Qt.green, 1))
+        for band in self.bands:
+            poly = (band - (ox, oy)) * s
+            painter.drawPolygon(QPolygonF([QPointF(x, y) for x, y in poly.tolist()]))
+        if self.region is not None:
+            painter.setPen(QPen(Qt.red, 1))
+            poly = (self.region - (ox, oy)) * s
+            painter.drawPolygon(QPolygonF([QPointF(x, y) for x, y in poly.tolist()]))
+
+    def _marker_layer(self, pts):
+        """
+        Rasterizes a small yellow cross at every point into a transparent
+        widget-sized image, with numpy instead of one paint call per cell
+        """
+        h, w = self.height(), self.width()
+        layer = np.zeros((h, w, 4), dtype=np.uint8)
+        xs, ys = pts[:, 0].astype(np.intp), pts[:, 1].astype(np.intp)
+        for dx, dy in ((0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)):
+            layer[np.clip(ys + dy, 0, h - 1), np.clip(xs + dx, 0, w - 1)] = (0, 255, 255, 255)
+        self._layer = layer  # QImage below shares this memory
+        return QImage(layer.data, w, h, w * 4, QImage.Format_ARGB32)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.start_drag(event)
+
+    def mouseMoveEvent(self, event):
+        self.drag_to(event)
+
+    def mouseReleaseEvent(self, event):
+        self.end_drag()
+
+    def mouseDoubleClickEvent(self, event):
+        self.reset_view()
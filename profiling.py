@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class StageProfiler:
+    def __init__(self, memory: bool = False):
+        """
+        Records wall time, CPU time and allocated bytes of pipeline stages
+        Assign to CellCount.profiler (or TiledCellCount.profiler) to enable;
+        with profiler None the pipeline does no timing at all
+
+        memory=True traces allocations with tracemalloc (started here if it is
+        not running already), which slows numpy-heavy stages noticeably
+        """
+        self.memory = memory
+        self.events = []
+        self._observers = []
+        self._lock = threading.Lock()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def subscribe(self, callback):
+        """callback(event) is called after every recorded stage, on the thread that ran it"""
+        self._observers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._observers.remove(callback)
+
+    def clear(self):
+        with self._lock:
+            self.events = []
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager recording one stage event:
+        name, start (s), wall (s), cpu (s, thread CPU time), alloc (net bytes),
+        peak (bytes above the start level), pid, tid
+        """
+        tracing = self.memory and tracemalloc.is_tracing()
+        if tracing:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        cpu = time.thread_time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.thread_time() - cpu
+            alloc = peak = None
+            if tracing:
+                current, peak = tracemalloc.get_traced_memory()
+                alloc, peak = current - before, peak - before
+            event = {"name": name, "start": start, "wall": wall, "cpu": cpu,
+                     "alloc": alloc, "peak": peak,
+                     "pid": os.getpid(), "tid": threading.get_ident()}
+            with self._lock:
+                self.events.append(event)
+            for callback in list(self._observers):
+                callback(event)
+
+    def measure(self, name, fn):
+        """Returns fn() recorded as stage name"""
+        with self.stage(name):
+            return fn()
+
+    def summary(self, events=None):
+        """
+        Returns {stage: {"calls", "wall", "cpu", "peak"}} totalled over events,
+        in order of first occurrence; peak is the largest single peak (or None)
+        """
+        totals = {}
+        for e in self.events if events is None else events:
+            t = totals.setdefault(e["name"], {"calls": 0, "wall": 0.0, "cpu": 0.0, "peak": None})
+            t["calls"] += 1
+            t["wall"] += e["wall"]
+            t["cpu"] += e["cpu"]
+            if e["peak"] is not None:
+                t["peak"] = max(t["peak"] or 0, e["peak"])
+        return totals
+
+    def format_summary(self, events=None):
+        """Returns summary() as aligned text, one stage per line"""
+        lines = []
+        for name, t in self.summary(events).items():
+            line = f"{name:<16}{t['wall'] * 1000:>9.1f} ms{t['cpu'] * 1000:>9.1f} ms cpu"
+            if t["calls"] > 1:
+                line += f"  x{t['calls']}"
+            if t["peak"] is not None:
+                line += f"{t['peak'] / 2**20:>9.1f} MB"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def chrome_trace(self, events=None):
+        """
+        Returns events in Chrome trace-event format (load in chrome://tracing
+        or Perfetto)
+        """
+        trace = []
+        for e in self.events if events is None else events:
+            args = {"cpu_ms": round(e["cpu"] * 1000, 3)}
+            if e["alloc"] is not None:
+                args.update(alloc_bytes=e["alloc"], peak_bytes=e["peak"])
+            trace.append({"name": e["name"], "cat": "cellcount", "ph": "X",
+                          "ts": e["start"] * 1e6, "dur": e["wall"] * 1e6,
+                          "pid": e["pid"], "tid": e["tid"], "args": args})
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def save_chrome_trace(self, path, events=None):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(events), f)
@@ -0,0 +1,159 @@
+import hashlib
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+# Default size limit of a ResultCache directory
+DEFAULT_MAX_BYTES = 2 * 2**30
+# Eviction frees space down to this fraction of the limit, so a full cache is
+# scanned once per tenth of its size written rather than on every put
+EVICT_TO = 0.9
+
+
+def image_digest(img, chunk: int = 1 << 24):
+    """
+    Returns hex digest identifying image content
+    Arrays are hashed with shape and dtype; lazily opened TIFFs (TiffImage)
+    hash the file in chunks plus the plane/channel they select, so the image
+    is never held in memory for it
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(repr((tuple(img.shape), str(img.dtype))).encode())
+    if isinstance(img, np.ndarray):
+        if img.flags.c_contiguous:
+            h.update(memoryview(img).cast("B"))
+        else:
+            for row in img:
+                h.update(np.ascontiguousarray(row).data)
+        return h.hexdigest()
+
+    h.update(repr(img.key).encode())
+    with open(img.path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, directory, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        On-disk cache of pipeline stage results, shared between runs and processes
+        Entries are compressed .npz files named by a hash of their key. Writes go
+        to a temporary file that is renamed into place, so readers in other
+        processes see either the old or the new entry, never a partial one.
+        Hits refresh the file time; when the directory grows past max_bytes the
+        least recently used entries are removed. The size is tracked as a
+        running total, so the directory is only scanned at startup and when the
+        total goes over max_bytes (the total also corrects for entries other
+        processes added in between)
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._size = self.size()
+
+    def _path(self, key):
+        name = hashlib.sha256(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, name + ".npz")
+
+    def get(self, key):
+        """
+        Returns the stored result (array, scalar or tuple of them) or None
+        """
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                n = int(data["n"])
+                values = tuple(self._unpack(data[f"v{i}"]) for i in range(n if n >= 0 else 1))
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Unreadable entry (e.g. left by a full disk): drop it and recompute
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)  # marks it recently used
+        except OSError:
+            pass
+        return values if n >= 0 else values[0]
+
+    def put(self, key, value):
+        """
+        Stores value (array, scalar or tuple of them) under key
+        """
+        values = value if isinstance(value, tuple) else (value,)
+        arrays = {f"v{i}": np.asarray(v) for i, v in enumerate(values)}
+        # n = -1 marks a single value rather than a tuple
+        arrays["n"] = np.array(len(values) if isinstance(value, tuple) else -1)
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            # Same layout as np.savez_compressed, at the fastest deflate level
+            with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED,
+                                                           compresslevel=1) as zf:
+                for name, arr in arrays.items():
+                    with zf.open(name + ".npy", "w", force_zip64=True) as member:
+                        np.lib.format.write_array(member, arr, allow_pickle=False)
+            path = self._path(key)
+            added = os.path.getsize(tmp)
+            try:
+                added -= os.path.getsize(path)  # replaced entry
+            except OSError:
+                pass
+            os.replace(tmp, path)
+        except BaseException:
+            self._remove(tmp)
+            raise
+        self._size += added
+        if self._size > self.max_bytes:
+            self.evict()
+
+    @staticmethod
+    def _unpack(arr):
+        # 0-d arrays hold scalars such as the Otsu value
+        return arr.item() if arr.ndim == 0 else arr
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # already removed by another process, or still open on Windows
+
+    def entries(self):
+        """Returns (mtime, size, path) of every entry, least recently used first"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".npz"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return sorted(entries)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache fits in max_bytes,
+        down to EVICT_TO of it once it had to remove any
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes if total <= self.max_bytes else EVICT_TO * self.max_bytes
+        for _, size, path in entries:
+            if total <= target:
+                break
+            self._remove(path)
+            total -= size
+        self._size = total
+
+    def clear(self):
+        for _, _, path in self.entries():
+            self._remove(path)
+        self._size = 0
@@ -0,0 +1,217 @@
+import cv2 as cv
+import numpy as np
+
+# Slider positions of CellCountWindow
+PTF_VALUES = np.arange(25, 51) / 100
+MIN_AREA_VALUES = np.arange(20, 201)
+
+
+class ParameterSweep:
+    def __init__(self,
+                 analysis,
+                 channel: int = 2,
+                 max_area: int = 20000,
+                 blur_ksize: int = 3,
+                 maxima_ksize: int = 7,
+                 dilate_iters: int = 2,
+                 do_seed_supplement: bool = True):
+        """
+        Cell counts for many (peak_thresh_frac, min_area) pairs from one segmentation
+        analysis: CellCount whose image, roi, region and cached stages are used
+
+        Watershed basins never cross connected components of the dilated
+        foreground, so the count is a sum over those components. Within one
+        component the seeds for a threshold are a prefix of its peaks sorted by
+        height, so each component is only re-flooded for the seed sets that
+        actually occur, and min_area only filters the stored basin areas.
+        Counts equal CellCount.run() with the watershed engine for every pair.
+        """
+        if blur_ksize % 2 == 0:
+            blur_ksize += 1
+        if maxima_ksize % 2 == 0:
+            maxima_ksize += 1
+
+        self.analysis = analysis
+        self.max_area = max_area
+        self.do_seed_supplement = do_seed_supplement
+
+        stages, _ = analysis._base(channel, blur_ksize, maxima_ksize)
+        self.nuclei_norm = stages["nuclei_norm"]
+        self.dist_max = stages["dist_max"]
+        binary = stages["binary"]
+
+        # --- Threshold-indexed peaks: local maxima sorted by height ---
+        py, px = np.nonzero(stages["local_max"])
+        heights = stages["dist_blur"][py, px]
+        order = np.argsort(-heights, kind="stable")
+        self.peak_y, self.peak_x, self.peak_heights = py[order], px[order], heights[order]
+
+        # --- Independent flooding basins: components of the dilated foreground ---
+        k3 = cv.getStructuringElement(cv.MORPH_ELLIPSE, (3, 3))
+        sure_bg = cv.dilate(binary, k3, iterations=dilate_iters)
+        self.num_bg, self.bg_labels, self.bg_stats, _ = cv.connectedComponentsWithStats(
+            sure_bg, connectivity=8)
+
+        peak_bg = self.bg_labels[self.peak_y, self.peak_x]
+        by_bg = np.argsort(peak_bg, kind="stable")  # keeps height order within a basin
+        starts = np.searchsorted(peak_bg[by_bg], np.arange(self.num_bg + 1))
+        self.bg_peaks = [by_bg[starts[c]:starts[c + 1]] for c in range(self.num_bg)]
+
+        # --- Foreground components that may receive a supplementary seed ---
+        num_cc, cc_labels, self.cc_areas, self.cc_argmax = stages["components"]
+        self.cc_top = np.full(num_cc, -np.inf, dtype=np.float64)
+        np.maximum.at(self.cc_top, cc_labels[self.peak_y, self.peak_x], self.peak_heights)
+        cc_ids = np.arange(1, num_cc)
+        cc_bg = self.bg_labels.ravel()[self.cc_argmax[cc_ids]]
+        by_bg = np.argsort(cc_bg, kind="stable")
+        starts = np.searchsorted(cc_bg[by_bg], np.arange(self.num_bg + 1))
+        self.bg_components = [cc_ids[by_bg[starts[c]:starts[c + 1]]] for c in range(self.num_bg)]
+
+        # --- Counting region raster ---
+        self.region_mask = None
+        if analysis.region is not None:
+            self.region_mask = np.zeros(binary.shape, dtype=np.uint8)
+            cv.fillPoly(self.region_mask, [analysis._roi_region().astype(np.int32)], 1)
+
+        self._basins = {}  # (component, seed count, supplemented) -> basin areas
+
+    def seed_count(self, peak_thresh_frac):
+        """Number of peak seeds (before supplementation) for a threshold"""
+        thresh = peak_thresh_frac * self.dist_max
+        return int(np.count_nonzero(self.peak_heights > thresh))
+
+    def counts(self, ptf_values=PTF_VALUES, min_area_values=MIN_AREA_VALUES):
+        """
+        Returns array counts[i, j] for ptf_values[i] and min_area_values[j]
+        """
+        ptf_values = np.atleast_1d(np.asarray(ptf_values, dtype=np.float64))
+        min_area_values = np.atleast_1d(np.asarray(min_area_values))
+        # Same product CellCount computes, compared at the precision of the peaks
+        thresh = np.array([f * self.dist_max for f in ptf_values.tolist()])
+        thresh = thresh.astype(self.peak_heights.dtype)
+        n_ptf, n_area = len(ptf_values), len(min_area_values)
+        counts = np.zeros((n_ptf, n_area), dtype=np.int64)
+
+        for c in range(1, self.num_bg):
+            peaks = self.bg_peaks[c]
+            heights = np.sort(self.peak_heights[peaks])
+            k = len(heights) - np.searchsorted(heights, thresh, side="right")
+
+            # Supplementary seed for component b where it has no peak above the
+            # threshold and its area is in [min_area, max_area]
+            comps = self.bg_components[c] if self.do_seed_supplement else []
+            if len(comps):
+                areas = self.cc_areas[comps]
+                comps = comps[(areas <= self.max_area) & (areas >= min_area_values.min())
+                              & (self.cc_top[comps] <= thresh.max())]
+
+            if not len(comps):
+                if not k.any():
+                    continue
+                states, inverse = np.unique(k, return_inverse=True)
+                for s, n_seeds in enumerate(states):
+                    per_area = self._basin_counts(c, n_seeds, (), min_area_values)
+                    counts[inverse == s] += per_area
+                continue
+
+            no_peak = self.cc_top[comps][None, :] <= thresh[:, None]
+            in_range = self.cc_areas[comps][None, :] >= min_area_values[:, None]
+            bits = no_peak[:, None, :] & in_range[None, :, :]
+            # State of a grid point: seed count, then one column per component
+            # telling whether it is supplemented; any number of components fits
+            state = np.concatenate((np.broadcast_to(k[:, None, None], (n_ptf, n_area, 1)),
+                                    bits), axis=2).reshape(n_ptf * n_area, -1)
+            states, inverse = np.unique(state, axis=0, return_inverse=True)
+            inverse = inverse.reshape(n_ptf, n_area)
+
+            for s, value in enumerate(states):
+                n_seeds = int(value[0])
+                supplemented = tuple(int(b) for b in comps[value[1:] > 0])
+                if n_seeds == 0 and not supplemented:
+                    continue
+                per_area = self._basin_counts(c, n_seeds, supplemented, min_area_values)
+                counts += np.where(inverse == s, per_area[None, :], 0)
+
+        return counts
+
+    def _basin_counts(self, c, n_seeds, supplemented, min_area_values):
+        """
+        Number of cells in basin c with area in [min_area, max_area] for each min_area
+        """
+        key = (c, n_seeds, supplemented)
+        if key not in self._basins:
+            self._basins[key] = self._flood(c, n_seeds, supplemented)
+        areas = self._basins[key]
+        upper = np.searchsorted(areas, self.max_area, side="right")
+        return upper - np.searchsorted(areas, min_area_values, side="left")
+
+    def _flood(self, c, n_seeds, supplemented):
+        """
+        Runs watershed on basin c alone with its n_seeds highest peaks and the
+        supplementary seeds, exactly as CellCount floods it in the full image
+        Returns sorted areas of the resulting cells inside the counting region
+        """
+        h, w = self.bg_labels.shape
+        x, y, bw, bh = self.bg_stats[c, :4]
+        x0, y0 = max(x - 2, 0), max(y - 2, 0)
+        x1, y1 = min(x + bw + 2, w), min(y + bh + 2, h)
+
+        seeds = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        peaks = self.bg_peaks[c][:n_seeds]
+        seeds[self.peak_y[peaks] - y0, self.peak_x[peaks] - x0] = 255
+        for b in supplemented:
+            sy, sx = divmod(int(self.cc_argmax[b]), w)
+            cv.circle(seeds, (sx - x0, sy - y0), 1, 255, -1)
+
+        _, markers = cv.connectedComponents(seeds)
+        markers = markers + 1
+        markers[(self.bg_labels[y0:y1, x0:x1] == c) & (seeds == 0)] = 0
+
+        base = cv.cvtColor(self.nuclei_norm[y0:y1, x0:x1], cv.COLOR_GRAY2BGR)
+        markers_ws = cv.watershed(base, markers)
+
+        labels = markers_ws.ravel()
+        areas = np.bincount(labels[labels > 1])
+        ids = np.flatnonzero(areas)
+
+        if self.region_mask is not None:
+            ids = ids[self._in_region(markers_ws, ids, areas[ids], x0, y0)]
+        return np.sort(areas[ids])
+
+    def _in_region(self, markers_ws, ids, areas, x0, y0):
+        """Same cell selection as CellCount._select, on one basin crop"""
+        region = self.region_mask[y0:y0 + markers_ws.shape[0], x0:x0 + markers_ws.shape[1]]
+        if self.analysis.region_select == "overlap":
+            inside = np.bincount(markers_ws[(region > 0) & (markers_ws > 1)],
+                                 minlength=int(ids.max()) + 1 if len(ids) else 1)
+            return 2 * inside[ids] >= areas
+
+        pos = np.flatnonzero(markers_ws > 1)
+        lab = markers_ws.ravel()[pos]
+        ys, xs = np.divmod(pos, markers_ws.shape[1])
+        size = int(ids.max()) + 1 if len(ids) else 1
+        m00 = np.bincount(lab, minlength=size)[ids]
+        cx = (np.bincount(lab, weights=xs, minlength=size)[ids] / m00).astype(np.intp)
+        cy = (np.bincount(lab, weights=ys, minlength=size)[ids] / m00).astype(np.intp)
+        return region[cy, cx] > 0
+
+    def suggest(self, ptf_values=PTF_VALUES, min_area_values=MIN_AREA_VALUES, window=3):
+        """
+        Suggests parameters from the most stable plateau of the count surface:
+        the pair whose neighbourhood (window x window grid points) has the
+        smallest relative count change
+        Returns (peak_thresh_frac, min_area, count, counts)
+        """
+        counts = self.counts(ptf_values, min_area_values)
+        c = counts.astype(np.float32)
+        scale = np.maximum(c, 1)
+        change = np.zeros_like(c)
+        change[:-1] = np.maximum(change[:-1], np.abs(np.diff(c, axis=0)) / scale[:-1])
+        change[1:] = np.maximum(change[1:], np.abs(np.diff(c, axis=0)) / scale[1:])
+        change[:, :-1] = np.maximum(change[:, :-1], np.abs(np.diff(c, axis=1)) / scale[:, :-1])
+        change[:, 1:] = np.maximum(change[:, 1:], np.abs(np.diff(c, axis=1)) / scale[:, 1:])
+        change = cv.blur(change, (window, window), borderType=cv.BORDER_REPLICATE)
+        change[counts == 0] = np.inf
+
+        i, j = np.unravel_index(np.argmin(change), change.shape)
+        return float(ptf_values[i]), int(min_area_values[j]), int(counts[i, j]), counts
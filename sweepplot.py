@@ -0,0 +1,57 @@
+from PySide6.QtCore import Qt, QPointF
+from PySide6.QtGui import QPainter, QPen, QPolygonF
+from PySide6.QtWidgets import QWidget
+
+
+class SweepPlot(QWidget):
+    def __init__(self, width=380, height=100):
+        super().__init__()
+        self.xs = []
+        self.ys = []
+        self.current = None
+        self.setFixedSize(width, height)
+
+    def set_data(self, xs, ys, current=None):
+        """
+        Sets curve (parameter values, counts) and marked current parameter value
+        """
+        self.xs = list(xs)
+        self.ys = list(ys)
+        self.current = current
+        self.update()
+
+    def paintEvent(self, event):
+        """
+        Draws count curve (yellow) and current parameter value (red)
+        """
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.black)
+        if len(self.xs) < 2:
+            painter.setPen(Qt.gray)
+            painter.drawText(self.rect(), Qt.AlignCenter, "Press Suggest to plot count")
+            return
+
+        left, top = 40, 5
+        w = self.width() - left - 5
+        h = self.height() - top - 5
+        x_min, x_max = self.xs[0], self.xs[-1]
+        y_min, y_max = min(self.ys), max(self.ys)
+        x_span = (x_max - x_min) or 1
+        y_span = (y_max - y_min) or 1
+
+        def to_point(x, y):
+            return QPointF(left + (x - x_min) / x_span * w,
+                           top + h - (y - y_min) / y_span * h)
+
+        painter.setPen(Qt.gray)
+        painter.drawText(0, top + 10, f"{y_max}")
+        painter.drawText(0, top + h, f"{y_min}")
+        painter.drawRect(left, top, w, h)
+
+        painter.setPen(QPen(Qt.yellow, 1))
+        painter.drawPolyline(QPolygonF([to_point(x, y) for x, y in zip(self.xs, self.ys)]))
+
+        if self.current is not None:
+            painter.setPen(QPen(Qt.red, 1))
+            p = to_point(self.current, y_min)
+            painter.drawLine(QPointF(p.x(), top), QPointF(p.x(), top + h))
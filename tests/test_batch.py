@@ -0,0 +1,47 @@
+import csv
+import os
+import sys
+
+import cv2 as cv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batch
+from benchmark import synthetic_field
+
+
+def read_rows(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_resume_skips_counted_images(tmp_path):
+    for name in ("a.png", "b.png"):
+        img, _, _ = synthetic_field(200, 200, seed=len(name))
+        cv.imwrite(str(tmp_path / name), img)
+    output = str(tmp_path / "counts.csv")
+    argv = [str(tmp_path), "--output", output, "--processes", "1"]
+
+    assert batch.main(argv) == 0
+    rows = read_rows(output)
+    assert len(rows) == 2 and all(row["count"] and not row["error"] for row in rows)
+
+    # Same options: nothing to do; other max_area: counted again
+    assert batch.main(argv) == 0
+    assert len(read_rows(output)) == 2
+    assert batch.main(argv + ["--max-area", "60"]) == 0
+    rows = read_rows(output)
+    assert len(rows) == 4 and {row["max_area"] for row in rows} == {"20000", "60"}
+
+
+def test_old_results_without_new_columns_still_resume(tmp_path):
+    output = str(tmp_path / "counts.csv")
+    with open(output, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["path", "count", "peak_thresh_frac", "min_area", "channel", "error"])
+        writer.writerow(["a.png", "12", "0.35", "40", "2", ""])
+
+    batch.ResultWriter(output).close()
+    assert set(batch.FIELDS) <= set(read_rows(output)[0])
+    args = batch.parse_args(["a.png", "--output", output])
+    assert batch.args_result_key("a.png", args) in batch.read_done(output)
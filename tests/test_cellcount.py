@@ -0,0 +1,51 @@
+import os
+import sys
+
+import cv2 as cv
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import synthetic_field
+from cellcount import CellCount
+
+
+def test_normalize_matches_normalize_then_astype():
+    rng = np.random.default_rng(0)
+    for img in (rng.integers(0, 4096, (80, 80)).astype(np.uint16),
+                rng.integers(0, 256, (80, 80)).astype(np.uint8),
+                rng.random((80, 80), dtype=np.float32) * 1000):
+        expected = cv.normalize(img, None, 0, 255, cv.NORM_MINMAX).astype(np.uint8)
+        assert np.array_equal(CellCount(img, 0.35, 20)._normalize(0), expected), img.dtype
+
+
+def separated_disks():
+    """Twenty-five disks of radius 8 on a 5 x 5 grid, well apart"""
+    img = np.zeros((250, 250, 3), dtype=np.uint8)
+    for y in range(25, 250, 50):
+        for x in range(25, 250, 50):
+            cv.circle(img, (x, y), 8, (0, 0, 255), -1)
+    return cv.GaussianBlur(img, (5, 5), 0)
+
+
+def count_with(img, engine, min_area):
+    analysis = CellCount(img, 0.35, min_area)
+    analysis.engine = engine
+    count, _, debug = analysis.run(outputs=())
+    return count, debug["engine"]
+
+
+def test_auto_engine_keeps_watershed_count():
+    for cluster_frac in (0.0, 0.3):
+        img, _, _ = synthetic_field(512, 512, cluster_frac=cluster_frac)
+        for min_area in (10, 40):
+            expected, _ = count_with(img, "watershed", min_area)
+            count, engine = count_with(img, "auto", min_area)
+            assert count == expected, (cluster_frac, min_area, engine)
+
+
+def test_auto_engine_uses_components_on_separated_nuclei():
+    img = separated_disks()
+    assert count_with(img, "watershed", 20) == (25, "watershed")
+    assert count_with(img, "components", 20) == (25, "components")
+    assert count_with(img, "auto", 20) == (25, "components")
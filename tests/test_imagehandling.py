@@ -0,0 +1,57 @@
+import os
+import sys
+
+import numpy as np
+import tifffile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from imagehandling import ImageHandling, TiffImage
+from zstack import StackReader, project
+
+
+def write_stack(path, compression=None):
+    """Z x C x Y x X ImageJ stack (4 planes, 3 channels) and the array written"""
+    stack = np.random.default_rng(0).integers(0, 4096, (4, 3, 40, 50)).astype(np.uint16)
+    tifffile.imwrite(path, stack, imagej=compression is None, compression=compression,
+                     photometric="minisblack", metadata={"axes": "ZCYX"})
+    return stack
+
+
+def test_tiff_image_indexing(tmp_path):
+    path = str(tmp_path / "stack.tif")
+    stack = write_stack(path)
+
+    image = TiffImage(path, page=2)
+    assert image.pages == 4
+    assert image.shape == (40, 50, 3) and image.dtype == np.uint16
+    assert np.array_equal(image[()], stack[2].transpose(1, 2, 0))
+    assert np.array_equal(image[5:9, 10:20], stack[2, :, 5:9, 10:20].transpose(1, 2, 0))
+    assert np.array_equal(image[7], stack[2, :, 7].T)
+    assert np.array_equal(image[3, 4], stack[2, :, 3, 4])
+
+    channel = TiffImage(path, channel=1, page=3)
+    assert channel.shape == (40, 50)
+    assert np.array_equal(channel[::2, 1:], stack[3, 1, ::2, 1:])
+    assert np.array_equal(channel.plane(0)[()], stack[0, 1])
+
+
+def test_eager_and_lazy_loads_agree(tmp_path):
+    path = str(tmp_path / "stack.tif")
+    write_stack(path)
+    for kwargs in ({}, {"channel": 2}, {"page": 1}):
+        eager, lazy = ImageHandling(), ImageHandling()
+        assert eager.load_path(path, **kwargs) and lazy.load_path(path, lazy=True, **kwargs)
+        assert isinstance(lazy.loaded_image, TiffImage)
+        assert np.array_equal(eager.loaded_image, lazy.loaded_image[()])
+
+
+def test_stack_projection(tmp_path):
+    for compression in (None, "zlib"):
+        path = str(tmp_path / f"stack-{compression}.tif")
+        stack = write_stack(path, compression)
+        reader = StackReader(path, channel=2, threads=2)
+        assert len(reader) == 4 and reader.shape == (40, 50)
+        assert np.array_equal(reader[3], stack[3, 2])
+        assert np.array_equal(project(reader, "max"), stack[:, 2].max(axis=0))
+        assert np.allclose(project(reader, "mean"), stack[:, 2].mean(axis=0))
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from maskgenerator import MaskGenerator
+
+
+def test_roi_is_masked_crop():
+    img = np.random.default_rng(0).integers(0, 256, (300, 400, 3)).astype(np.uint8)
+    generator = MaskGenerator(img, [(100, 80), (300, 90)], [(100, 200), (300, 190)], margin=10)
+
+    assert generator.bbox == (90, 70, 311, 211)
+    assert generator.offset == (90, 70)
+    assert np.shares_memory(generator.roi, img)
+    x0, y0, x1, y1 = generator.bbox
+    assert np.array_equal(generator.roi_mask, generator.mask[y0:y1, x0:x1])
+    assert np.array_equal(generator.roi_masked, generator.masked[y0:y1, x0:x1])
+    assert not generator.masked[:y0].any() and not generator.masked[y1:].any()
@@ -0,0 +1,74 @@
+import csv
+import os
+import sys
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cellcount import CellCount
+from measurements import CellTableWriter, polyline_distance
+
+
+def disk_field():
+    """Nine separated disks of radius 6 on a 3 x 3 grid, centres at 30 + 40 i"""
+    img = np.zeros((120, 120), dtype=np.uint8)
+    for y in range(30, 120, 40):
+        for x in range(30, 120, 40):
+            cv.circle(img, (x, y), 6, 255, -1)
+    return cv.GaussianBlur(img, (3, 3), 0)
+
+
+def test_polyline_distance():
+    curve = [(0, 0), (10, 0), (10, 10)]
+    points = [(5, 3), (15, 5), (-4, -3), (10, 0)]
+    assert np.allclose(polyline_distance(points, curve), [3, 5, 5, 0])
+
+
+def test_distance_to_curves_column():
+    analysis = CellCount(disk_field(), 0.35, 20)
+    analysis.curves = {"start": [(0, 10), (120, 10)], "stop": [(100, 0), (100, 120)]}
+    count, _, debug = analysis.run(channel=0, outputs=("measurements",))
+    cells = debug["measurements"]
+
+    assert count == 9
+    assert np.allclose(cells["dist_start"], cells["cy"] - 10)
+    assert np.allclose(cells["dist_stop"], np.abs(cells["cx"] - 100))
+    assert np.allclose(np.sort(np.unique(np.round(cells["dist_start"]))), [20, 60, 100])
+
+
+def test_csv_writer_appends(tmp_path):
+    path = str(tmp_path / "cells.csv")
+    columns = {"cell": np.arange(1, 4), "area": np.array([10.5, 20, 30])}
+    for name in ("a.tif", "b,c.tif"):
+        writer = CellTableWriter(path)
+        writer.write(columns, path=name)
+        writer.close()
+
+    with open(path, newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["path", "cell", "area"]
+    assert rows[1] == ["a.tif", "1", "10.5"]
+    assert [row[0] for row in rows[1:]] == ["a.tif"] * 3 + ["b,c.tif"] * 3
+
+
+def test_parquet_dataset_keeps_earlier_runs(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "cells.parquet")
+    columns = {"cell": np.arange(1, 4), "area": np.array([10.5, 20, 30])}
+    for name in ("a.tif", "b.tif"):
+        writer = CellTableWriter(path)
+        writer.write(columns, path=name)
+        writer.close()
+    CellTableWriter(path).close()  # nothing written: no empty part
+
+    assert sorted(os.listdir(path)) == ["part-0.parquet", "part-1.parquet"]
+    table = pq.read_table(path).to_pydict()
+    assert sorted(table["path"]) == ["a.tif"] * 3 + ["b.tif"] * 3
+    assert sorted(table["area"]) == [10.5, 10.5, 20, 20, 30, 30]
+
+    (tmp_path / "file.parquet").write_bytes(b"")
+    with pytest.raises(ValueError):
+        CellTableWriter(str(tmp_path / "file.parquet"))
@@ -0,0 +1,62 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import synthetic_field
+from cellcount import CellCount
+from profiling import StageProfiler
+from resultcache import ResultCache
+
+OUTPUTS = ("labels", "centroids", "markers_ws")
+
+
+def assert_same_run(a, b):
+    assert a[0] == b[0]
+    for name in OUTPUTS:
+        assert np.array_equal(a[2][name], b[2][name]), name
+
+
+def test_memory_cache_hit_equals_fresh_run():
+    img, _, _ = synthetic_field(300, 300)
+    analysis = CellCount(img, 0.35, 20)
+    analysis.run(outputs=OUTPUTS)
+    analysis.peak_thresh_frac, analysis.min_area = 0.5, 40
+    assert_same_run(analysis.run(outputs=OUTPUTS), CellCount(img, 0.5, 40).run(outputs=OUTPUTS))
+    analysis.peak_thresh_frac, analysis.min_area = 0.35, 20
+    assert_same_run(analysis.run(outputs=OUTPUTS), CellCount(img, 0.35, 20).run(outputs=OUTPUTS))
+
+
+def test_disk_cache_hit_equals_fresh_run(tmp_path):
+    img, _, _ = synthetic_field(300, 300)
+    cache = ResultCache(str(tmp_path))
+    first = CellCount(img, 0.35, 20)
+    first.disk_cache = cache
+    first.run(outputs=OUTPUTS)
+    assert cache.size() == cache._size > 0
+
+    # A new instance (e.g. another process) loads every stage from disk
+    second = CellCount(img.copy(), 0.35, 20)
+    second.disk_cache = ResultCache(str(tmp_path))
+    second.profiler = StageProfiler()
+    result = second.run(outputs=OUTPUTS)
+    stages = second.profiler.summary()
+    assert "watershed:disk" in stages and "watershed" not in stages
+    assert_same_run(result, CellCount(img, 0.35, 20).run(outputs=OUTPUTS))
+
+
+def test_result_cache_round_trip_and_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=20000)
+    value = (np.arange(12, dtype=np.int32).reshape(3, 4), 7.5)
+    cache.put("key", value)
+    stored = cache.get("key")
+    assert np.array_equal(stored[0], value[0]) and stored[1] == 7.5
+    assert cache.get("missing") is None
+
+    rng = np.random.default_rng(0)
+    for i in range(10):
+        cache.put(i, rng.integers(0, 256, 5000).astype(np.uint8))  # incompressible
+    assert cache._size == cache.size() <= cache.max_bytes
+    assert cache.get(9) is not None and cache.get(0) is None
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import cv2 as cv
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cellcount import CellCount
+from sweep import ParameterSweep
+
+
+def dense_basin_field():
+    """One large disk plus an 11 x 11 grid of small disks that dilation joins into one basin"""
+    img = np.zeros((300, 300), dtype=np.uint8)
+    cv.circle(img, (60, 60), 40, 255, -1)
+    for i in range(11):
+        for j in range(11):
+            cv.circle(img, (140 + 11 * i, 140 + 11 * j), 4, 255, -1)
+    return cv.GaussianBlur(img, (3, 3), 0)
+
+
+def test_sweep_matches_run_on_dense_basin():
+    img = dense_basin_field()
+    ptf_values = [0.25, 0.35, 0.5]
+    min_area_values = [10, 20, 40]
+
+    counts = ParameterSweep(CellCount(img, 0.35, 20), channel=0).counts(ptf_values,
+                                                                        min_area_values)
+    for i, ptf in enumerate(ptf_values):
+        for j, min_area in enumerate(min_area_values):
+            expected, _, _ = CellCount(img, ptf, min_area).run(channel=0, outputs=())
+            assert counts[i, j] == expected, (ptf, min_area)
+    assert counts[1, 1] == 122
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import synthetic_field
+from cellcount import CellCount
+from tiledcount import TiledCellCount, tile_grid
+
+
+def sorted_rows(points):
+    return np.array(sorted(map(tuple, np.round(points, 6))))
+
+
+def test_tile_grid_covers_image():
+    tiles = tile_grid(600, 700, 256)
+    covered = np.zeros((600, 700), dtype=int)
+    for y0, y1, x0, x1 in tiles:
+        covered[y0:y1, x0:x1] += 1
+    assert (covered == 1).all()
+
+
+def test_tiled_count_matches_full_image():
+    img, _, _ = synthetic_field(600, 700, cluster_frac=0.3)
+    count, _, debug = CellCount(img, 0.35, 20).run(outputs=("centroids",))
+    tiled_count, centroids, tiled_debug = TiledCellCount(img, 0.35, 20, tile_size=256,
+                                                         processes=1).run()
+
+    assert tiled_debug["tiles"] == 9
+    assert tiled_count == count
+    assert np.allclose(sorted_rows(centroids), sorted_rows(debug["centroids"]))
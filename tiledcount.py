@@ -0,0 +1,229 @@
+import os
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+from cellcount import CellCount, label_centroids, otsu_threshold
+
+
+def tile_grid(h, w, tile_size):
+    """
+    Returns core boxes (y0, y1, x0, x1) of the tiles covering an h x w image
+    """
+    return [(y, min(y + tile_size, h), x, min(x + tile_size, w))
+            for y in range(0, h, tile_size)
+            for x in range(0, w, tile_size)]
+
+
+def imap_bounded(fn, jobs, executor=None, limit=4):
+    """
+    Yields fn(job) for every job, in order
+    At most limit jobs are submitted to executor at once, so tiles are read
+    (and pickled to worker processes) only shortly before they are processed
+    """
+    if executor is None:
+        for job in jobs:
+            yield fn(job)
+        return
+
+    pending = deque()
+    for job in jobs:
+        pending.append(executor.submit(fn, job))
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+# =========================
+# Per-tile workers (module level so they can be pickled to a process pool)
+# =========================
+
+def _tile_analysis(job):
+    """
+    Builds a CellCount for one halo tile using the global image statistics
+    """
+    analysis = CellCount(job["tile"], job["peak_thresh_frac"], job["min_area"])
+    analysis.norm_range = job.get("norm_range")
+    analysis.otsu_value = job.get("otsu_value")
+    analysis.dist_max = job.get("dist_max")
+    return analysis
+
+
+def _tile_min_max(job):
+    lo, hi, _, _ = cv.minMaxLoc(job["tile"])
+    return lo, hi
+
+
+def _tile_histogram(job):
+    analysis = _tile_analysis(job)
+    nuclei_norm = analysis._normalize(0)
+    blur = cv.GaussianBlur(nuclei_norm, (job["blur_ksize"], job["blur_ksize"]), 0)
+    y0, y1, x0, x1 = job["core"]
+    return np.bincount(blur[y0:y1, x0:x1].ravel(), minlength=256)
+
+
+def _tile_dist_max(job):
+    analysis = _tile_analysis(job)
+    nuclei_norm = analysis._normalize(0)
+    _, _, binary = analysis._threshold(nuclei_norm, job["blur_ksize"])
+    dist, _ = analysis._distance(binary)
+    y0, y1, x0, x1 = job["core"]
+    core = dist[y0:y1, x0:x1]
+    return float(core.max()) if core.size else 0.0
+
+
+def _tile_count(job):
+    """
+    Segments one halo tile and keeps only the cells whose centroid lies in
+    the tile core, so cells crossing a seam are counted by exactly one tile
+    """
+    analysis = _tile_analysis(job)
+    stages, _ = analysis._segment(0, job["max_area"], job["blur_ksize"], job["maxima_ksize"],
+                                  job["dilate_iters"], job["do_seed_supplement"])
+    kept = stages["kept"]
+    area, cx, cy = label_centroids(stages["markers_ws"], kept)
+
+    y0, y1, x0, x1 = job["core"]
+    own = (cx >= x0) & (cx < x1) & (cy >= y0) & (cy < y1)
+    oy, ox = job["offset"]
+    centroids = np.column_stack((cx[own] + ox, cy[own] + oy))
+    return centroids, area[own]
+
+
+class TiledCellCount:
+    def __init__(self,
+                 img,
+                 peak_thresh_frac,
+                 min_area,
+                 tile_size: int = 2048,
+                 halo: int = 64,
+                 processes: int = None):
+        """
+        Counts cells tile by tile so peak memory depends on tile_size, not image size
+        halo should be at least the diameter of the largest cell; processes=1
+        runs in the calling process, None uses one process per core
+        """
+        self.img = img
+        self.peak_thresh_frac = peak_thresh_frac
+        self.min_area = min_area
+        self.tile_size = tile_size
+        self.halo = halo
+        self.processes = processes
+        self.profiler = None  # profiling.StageProfiler timing each pass, None = off
+
+    def _stage(self, name):
+        return nullcontext() if self.profiler is None else self.profiler.stage(name)
+
+    def _jobs(self, channel, halo, **fields):
+        """
+        Yields one job per tile: the nuclei channel of the tile plus halo,
+        the core box in tile coordinates and the tile offset in the image
+        """
+        img = self.img
+        h, w = img.shape[:2]
+        for y0, y1, x0, x1 in tile_grid(h, w, self.tile_size):
+            ty0, ty1 = max(0, y0 - halo), min(h, y1 + halo)
+            tx0, tx1 = max(0, x0 - halo), min(w, x1 + halo)
+            # Channel is selected in the same index so lazy images only read it
+            if img.ndim == 3:
+                tile = img[ty0:ty1, tx0:tx1, channel]
+            else:
+                tile = img[ty0:ty1, tx0:tx1]
+            job = {
+                "tile": np.ascontiguousarray(tile),
+                "core": (y0 - ty0, y1 - ty0, x0 - tx0, x1 - tx0),
+                "offset": (ty0, tx0),
+                "peak_thresh_frac": self.peak_thresh_frac,
+                "min_area": self.min_area
+            }
+            job.update(fields)
+            yield job
+
+    def run(self,
+            channel: int = 2,
+            max_area: int = 20000,
+            blur_ksize: int = 3,
+            maxima_ksize: int = 7,
+            dilate_iters: int = 2,
+            do_seed_supplement: bool = True):
+        """
+        Runs CellCount over overlapping tiles in a process pool
+        Normalization range, Otsu threshold and distance maximum are gathered
+        over all tiles first, so every tile is segmented with image-wide values
+        Returns count, (N, 2) array of cell centroids (x, y) and a debug dict
+        """
+        img = self.img
+        if not (img.ndim == 2 or (img.ndim == 3 and img.shape[2] == 3)):
+            raise ValueError(f"Unsupported image shape: {img.shape}")
+
+        if blur_ksize % 2 == 0:
+            blur_ksize += 1
+        if maxima_ksize % 2 == 0:
+            maxima_ksize += 1
+        # Halo must at least cover the blur, distance blur, maxima and dilation reach
+        halo = max(self.halo, blur_ksize // 2 + 1 + maxima_ksize // 2 + dilate_iters)
+
+        processes = self.processes or os.cpu_count() or 1
+        executor = ProcessPoolExecutor(max_workers=processes) if processes > 1 else None
+        limit = 2 * processes
+
+        try:
+            # --- Pass 1: normalization range ---
+            with self._stage("tiles:range"):
+                lo, hi = np.inf, -np.inf
+                for t_lo, t_hi in imap_bounded(_tile_min_max, self._jobs(channel, 0),
+                                               executor, limit):
+                    lo, hi = min(lo, t_lo), max(hi, t_hi)
+            norm_range = (lo, hi)
+
+            # --- Pass 2: Otsu threshold from summed histograms ---
+            with self._stage("tiles:otsu"):
+                hist = np.zeros(256, dtype=np.int64)
+                for t_hist in imap_bounded(_tile_histogram,
+                                           self._jobs(channel, halo, norm_range=norm_range,
+                                                      blur_ksize=blur_ksize),
+                                           executor, limit):
+                    hist += t_hist
+            otsu_value = otsu_threshold(hist)
+
+            # --- Pass 3: distance transform maximum ---
+            with self._stage("tiles:dist_max"):
+                dist_max = 0.0
+                for t_max in imap_bounded(_tile_dist_max,
+                                          self._jobs(channel, halo, norm_range=norm_range,
+                                                     otsu_value=otsu_value, blur_ksize=blur_ksize),
+                                          executor, limit):
+                    dist_max = max(dist_max, t_max)
+
+            # --- Pass 4: segmentation, cells owned by centroid ---
+            with self._stage("tiles:segment"):
+                centroids, areas = [], []
+                for t_centroids, t_areas in imap_bounded(
+                        _tile_count,
+                        self._jobs(channel, halo, norm_range=norm_range, otsu_value=otsu_value,
+                                   dist_max=dist_max, max_area=max_area, blur_ksize=blur_ksize,
+                                   maxima_ksize=maxima_ksize, dilate_iters=dilate_iters,
+                                   do_seed_supplement=do_seed_supplement),
+                        executor, limit):
+                    centroids.append(t_centroids)
+                    areas.append(t_areas)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        centroids = np.concatenate(centroids) if centroids else np.zeros((0, 2))
+        areas = np.concatenate(areas) if areas else np.zeros(0, dtype=np.int64)
+
+        debug = {
+            "norm_range": norm_range,
+            "otsu_value": otsu_value,
+            "dist_max": dist_max,
+            "areas": areas,
+            "tiles": len(tile_grid(img.shape[0], img.shape[1], self.tile_size))
+        }
+
+        return len(centroids), centroids, debug
@@ -0,0 +1,183 @@
+"""
+Headless counting of images as they appear in a directory
+
+Example:
+    python -m watch acquisition/ --output counts.csv --peak-thresh-frac 0.35 --min-area 40
+
+The directory is polled for .tif/.tiff/.png files (other image types too).
+A file is counted once its size and modification time have not changed for
+--settle seconds, so images still being written are left alone. At most
+--queue images are waiting for or being counted by the worker pool; when the
+microscope writes faster than the workers count, newer files simply stay on
+disk until a slot is free, oldest first, so memory use stays flat.
+
+Results are appended to the output file as each image finishes, in the same
+format as batch, and images already in it are skipped on restart.
+Stop with Ctrl-C; images in flight are finished first.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from batch import (IMAGE_EXTENSIONS, _init_worker, add_count_arguments, args_result_key,
+                   check_args, count_image, count_params, open_writers, read_done,
+                   report_profile, store_row)
+
+
+class DirectoryPoller:
+    def __init__(self, directory, settle: float = 1.0, recursive: bool = False):
+        """
+        Finds image files in directory that have stopped changing
+        A file is ready once its (size, mtime) is the same as at the previous
+        poll and its mtime is at least settle seconds old
+        Files marked with finish() are skipped without a stat, so a poll only
+        examines new and still changing files
+        """
+        self.directory = directory
+        self.settle = settle
+        self.recursive = recursive
+        self._last = {}  # path -> (size, mtime_ns) at the previous poll
+        self._finished = set()  # paths never reported again
+
+    def finish(self, path):
+        """Stops reporting path, e.g. once it is counted"""
+        self._finished.add(path)
+        self._last.pop(path, None)
+
+    def _scan(self, directory):
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if self.recursive:
+                    yield from self._scan(entry.path)
+            elif (entry.path not in self._finished
+                  and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, stat
+
+    def poll(self):
+        """
+        Returns [(mtime, path), ...] of ready files, oldest first
+        """
+        now = time.time()
+        current = {}
+        ready = []
+        for path, stat in self._scan(self.directory):
+            state = (stat.st_size, stat.st_mtime_ns)
+            current[path] = state
+            if self._last.get(path) == state and now - stat.st_mtime >= self.settle:
+                ready.append((stat.st_mtime, path))
+        self._last = current
+        return sorted(ready)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Count cells in images as they are written")
+    parser.add_argument("directory", help="directory the microscope writes images to")
+    add_count_arguments(parser)
+    parser.add_argument("--interval", type=float, default=0.5,
+                        help="seconds between directory polls")
+    parser.add_argument("--settle", type=float, default=1.0,
+                        help="seconds a file must stay unchanged before it is counted")
+    parser.add_argument("--queue", type=int, default=None,
+                        help="images queued or in progress at most (default: 2 per process)")
+    parser.add_argument("--idle-exit", type=float, default=None,
+                        help="stop after this many seconds without new images")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    error = check_args(args)
+    if error:
+        print(error, file=sys.stderr)
+        return 2
+    params = count_params(args)
+    processes = args.processes or os.cpu_count() or 1
+    limit = args.queue or 2 * processes
+
+    done = set() if args.no_resume else read_done(args.output)
+    poller = DirectoryPoller(args.directory, args.settle, args.recursive)
+    writer, cell_writer = open_writers(args)
+    in_flight = {}  # future -> (path, mtime)
+    latencies = []
+    events = []
+    failed = 0
+    last_activity = time.time()
+    print(f"Watching {args.directory} with {processes} processes, queue {limit}",
+          file=sys.stderr)
+
+    try:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker) as executor:
+            try:
+                while True:
+                    # --- Submit ready files while there is room: backpressure ---
+                    queued = {path for path, _ in in_flight.values()}
+                    for mtime, path in poller.poll():
+                        if len(in_flight) >= limit:
+                            break
+                        if path in queued:
+                            continue
+                        if args_result_key(path, args) in done:
+                            poller.finish(path)  # counted before a restart: key checked once
+                            continue
+                        in_flight[executor.submit(count_image, (path, params))] = (path, mtime)
+                        last_activity = time.time()
+
+                    # --- Store results as they complete; wait at most one poll interval ---
+                    if in_flight:
+                        finished, _ = wait(in_flight, timeout=args.interval,
+                                           return_when=FIRST_COMPLETED)
+                    else:
+                        finished = ()
+                        time.sleep(args.interval)
+                    for future in finished:
+                        path, mtime = in_flight.pop(future)
+                        row = future.result()
+                        failed += store_row(row, writer, cell_writer, events)
+                        # Not retried while watching; failed rows are retried after a restart
+                        poller.finish(path)
+                        latency = time.time() - mtime
+                        latencies.append(latency)
+                        last_activity = time.time()
+                        status = row["error"] or row["count"]
+                        print(f"{row['path']}: {status} ({latency:.2f} s after writing)",
+                              file=sys.stderr)
+
+                    if (args.idle_exit is not None and not in_flight
+                            and time.time() - last_activity >= args.idle_exit):
+                        break
+            except KeyboardInterrupt:
+                print(f"Stopping, finishing {len(in_flight)} images in flight", file=sys.stderr)
+                for future in list(in_flight):
+                    in_flight.pop(future)
+                    try:
+                        row = future.result()
+                    except Exception:
+                        continue  # worker interrupted too; counted again after a restart
+                    failed += store_row(row, writer, cell_writer, events)
+    finally:
+        writer.close()
+        if cell_writer is not None:
+            cell_writer.close()
+
+    if latencies:
+        lat = sorted(latencies)
+        print(f"{len(lat)} images, latency median {lat[len(lat) // 2]:.2f} s, "
+              f"95% {lat[int(0.95 * (len(lat) - 1))]:.2f} s, max {lat[-1]:.2f} s", file=sys.stderr)
+    if params["profile"]:
+        report_profile(args, events)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
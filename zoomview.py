@@ -0,0 +1,253 @@
+from collections import OrderedDict
+
+import cv2 as cv
+import numpy as np
+from PySide6.QtCore import Qt, QPointF, QRectF, QThreadPool
+from PySide6.QtGui import QImage, QPainter, QPixmap
+from PySide6.QtWidgets import QWidget
+
+from imagepyramid import ImagePyramid
+from worker import Worker
+
+MAX_ZOOM_SCALE = 16  # screen pixels per image pixel
+TILE_SIZE = 256      # pyramid tile edge in level pixels
+MAX_TILES = 256      # uploaded tile pixmaps kept for reuse
+ASYNC_PIXELS = 1 << 22  # larger images get their pyramid built on a worker thread
+
+
+def to_qimage(img, rgb=False):
+    """
+    input: uint8 grayscale, BGR (or RGB if rgb) array
+    Returns QImage sharing img's memory (keep img alive while it is used)
+    """
+    h, w = img.shape[:2]
+    if img.ndim == 2:
+        fmt = QImage.Format_Grayscale8
+    elif img.ndim == 3 and img.shape[2] == 3:
+        fmt = QImage.Format_RGB888 if rgb else QImage.Format_BGR888
+    else:
+        raise ValueError(f"Unsupported image shape: {img.shape}")
+    return QImage(img.data, w, h, img.strides[0], fmt)
+
+
+class ZoomPanView(QWidget):
+    def __init__(self, width, height, rgb=False):
+        """
+        Base widget showing an image through a cached pyramid: only the tiles
+        of the level matching the current zoom that touch the viewport are
+        converted to pixmaps. Zoom 1 fits the image to the widget
+        rgb: 3-channel images are RGB instead of BGR
+        """
+        super().__init__()
+        self.setFixedSize(width, height)
+        self.rgb = rgb
+        self.img = None
+        self.pyramid = None
+        self._alpha = None  # display scale for images that aren't uint8
+        self._build_signals = None  # signals of the pyramid build in progress
+
+        # --- View state: zoom relative to fit, image point at widget centre ---
+        self.zoom = 1.0
+        self.center = (0.0, 0.0)
+        self._drag = None
+
+        # --- Uploaded tiles: (level, tx, ty) -> QPixmap, least recently used first ---
+        self._tiles = OrderedDict()
+
+    def set_image(self, img, pyramid=None):
+        """
+        input: image array (None if only a pyramid of a still loading image is
+        available) and optionally an ImagePyramid of it to share
+        Tiles are only rebuilt when a different image is set; the view is kept
+        if the image size doesn't change
+        Pyramids of large images are built on a worker thread; the previous
+        pyramid (e.g. of the thumbnail) stays on screen until it is ready
+        """
+        if img is not None and img is self.img:
+            return
+        self.img = img
+        self._build_signals = None  # a build still running for an older image is dropped
+        if pyramid is None:
+            pyramid = ImagePyramid(img)
+            h, w = pyramid.shape[:2]
+            if pyramid.max_level > 0 and h * w > ASYNC_PIXELS:
+                worker = Worker(self._build_pyramid, pyramid)
+                self._build_signals = worker.signals
+                worker.signals.finished.connect(self.pyramid_built)
+                worker.signals.failed.connect(self.pyramid_failed)
+                QThreadPool.globalInstance().start(worker)
+                return
+        self._show_pyramid(pyramid)
+
+    @staticmethod
+    def _build_pyramid(pyramid):
+        pyramid.build()
+        return pyramid
+
+    def pyramid_built(self, pyramid):
+        if self.sender() is not self._build_signals:
+            return  # image was replaced while building
+        self._build_signals = None
+        self._show_pyramid(pyramid)
+
+    def pyramid_failed(self, message):
+        if self.sender() is not self._build_signals:
+            return
+        # Fall back to building levels on first use
+        self._build_signals = None
+        self._show_pyramid(ImagePyramid(self.img))
+
+    def _show_pyramid(self, pyramid):
+        old_shape = None if self.pyramid is None else self.pyramid.shape[:2]
+        self.pyramid = pyramid
+        self._tiles.clear()
+
+        # Other bit depths are scaled by the maximum of the coarsest level
+        self._alpha = None
+        if self.pyramid.dtype != np.uint8:
+            top = self.pyramid.level(self.pyramid.max_level)
+            self._alpha = 255.0 / max(float(top.max()), 1.0)
+
+        if self.pyramid.shape[:2] == old_shape:
+            self.update()
+        else:
+            self.reset_view()
+
+    def reset_view(self):
+        self.zoom = 1.0
+        if self.pyramid is not None:
+            h, w = self.pyramid.shape[:2]
+            self.center = (w / 2, h / 2)
+        self.update()
+
+    # =========================
+    # Coordinates
+    # =========================
+
+    def _fit_scale(self):
+        h, w = self.pyramid.shape[:2]
+        return min(self.width() / w, self.height() / h)
+
+    def _scale(self):
+        """Screen pixels per image pixel"""
+        return self._fit_scale() * self.zoom
+
+    def _origin(self):
+        """Image point shown at the widget's top left corner"""
+        s = self._scale()
+        return self.center[0] - self.width() / 2 / s, self.center[1] - self.height() / 2 / s
+
+    def to_image(self, pos):
+        """Widget position -> (x, y) in original image coordinates"""
+        s = self._scale()
+        ox, oy = self._origin()
+        return ox + pos.x() / s, oy + pos.y() / s
+
+    def to_screen(self, x, y):
+        """Original image coordinates -> widget position"""
+        s = self._scale()
+        ox, oy = self._origin()
+        return QPointF((x - ox) * s, (y - oy) * s)
+
+    def _clamp_center(self):
+        """Keeps the view inside the image; centres the image if it is smaller"""
+        h, w = self.pyramid.shape[:2]
+        s = self._scale()
+        half_w, half_h = self.width() / 2 / s, self.height() / 2 / s
+        cx = w / 2 if 2 * half_w >= w else min(max(self.center[0], half_w), w - half_w)
+        cy = h / 2 if 2 * half_h >= h else min(max(self.center[1], half_h), h - half_h)
+        self.center = (cx, cy)
+
+    # =========================
+    # Painting
+    # =========================
+
+    def paint_image(self, painter):
+        """Draws the visible pyramid tiles of the level matching the zoom"""
+        painter.fillRect(self.rect(), Qt.black)
+        if self.pyramid is None:
+            return
+
+        s = self._scale()
+        ox, oy = self._origin()
+        k = self.pyramid.level_for_scale(s)
+        f = 2 ** k  # level 0 pixels per level k pixel
+        level = self.pyramid.level(k)
+        lh, lw = level.shape[:2]
+
+        tx0, ty0 = max(int(ox / f) // TILE_SIZE, 0), max(int(oy / f) // TILE_SIZE, 0)
+        tx1 = min(int((ox + self.width() / s) / f) // TILE_SIZE, (lw - 1) // TILE_SIZE)
+        ty1 = min(int((oy + self.height() / s) / f) // TILE_SIZE, (lh - 1) // TILE_SIZE)
+
+        # Averaged when reduced, sharp pixels when magnified
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, s * f < 1)
+        for ty in range(ty0, ty1 + 1):
+            for tx in range(tx0, tx1 + 1):
+                pixmap = self._tile(k, tx, ty)
+                x, y = tx * TILE_SIZE * f, ty * TILE_SIZE * f
+                target = QRectF((x - ox) * s, (y - oy) * s,
+                                pixmap.width() * f * s, pixmap.height() * f * s)
+                painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, False)
+
+    def _tile(self, k, tx, ty):
+        """Returns pixmap of one level k tile, converting it on first use"""
+        key = (k, tx, ty)
+        pixmap = self._tiles.get(key)
+        if pixmap is not None:
+            self._tiles.move_to_end(key)
+            return pixmap
+
+        x0, y0 = tx * TILE_SIZE, ty * TILE_SIZE
+        tile = self.pyramid.region(k, x0, y0, x0 + TILE_SIZE, y0 + TILE_SIZE)
+        if self._alpha is not None:
+            tile = cv.convertScaleAbs(tile, alpha=self._alpha)
+        pixmap = QPixmap.fromImage(to_qimage(tile, self.rgb))
+        self._tiles[key] = pixmap
+        if len(self._tiles) > MAX_TILES:
+            self._tiles.popitem(last=False)
+        return pixmap
+
+    # =========================
+    # Zoom and pan
+    # =========================
+
+    def zoom_at(self, pos, steps):
+        """Zooms by 1.25**steps keeping the image point under pos in place"""
+        if self.pyramid is None:
+            return
+        px, py = self.to_image(pos)
+        max_zoom = max(1.0, MAX_ZOOM_SCALE / self._fit_scale())
+        self.zoom = float(np.clip(self.zoom * 1.25 ** steps, 1.0, max_zoom))
+        s = self._scale()
+        self.center = (px - pos.x() / s + self.width() / 2 / s,
+                       py - pos.y() / s + self.height() / 2 / s)
+        self._clamp_center()
+        self.update()
+
+    def pan_by(self, dx, dy):
+        """Moves the view by (dx, dy) screen pixels"""
+        if self.pyramid is None:
+            return
+        s = self._scale()
+        self.center = (self.center[0] - dx / s, self.center[1] - dy / s)
+        self._clamp_center()
+        self.update()
+
+    def wheelEvent(self, event):
+        self.zoom_at(event.position(), event.angleDelta().y() / 120)
+
+    def start_drag(self, event):
+        self._drag = event.position()
+
+    def drag_to(self, event):
+        """Pans by the mouse movement since start_drag; returns False if not dragging"""
+        if self._drag is None:
+            return False
+        pos = event.position()
+        self.pan_by(pos.x() - self._drag.x(), pos.y() - self._drag.y())
+        self._drag = pos
+        return True
+
+    def end_drag(self):
+        self._drag = None
@@ -0,0 +1,136 @@
+import os
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from cellcount import CellCount
+from imagehandling import TiffImage
+from tiledcount import imap_bounded
+
+PROJECTIONS = ("max", "mean")
+
+
+@lru_cache(maxsize=4)
+def _open_stack(path, channel, level, mtime_ns):
+    """TiffImage of the first plane, kept so each process opens a stack once"""
+    return TiffImage(path, channel=channel, level=level)
+
+
+def read_plane(job):
+    """
+    input: (path, page, channel, level)
+    Returns one Z/T/I plane of a TIFF as an array; the file is parsed once
+    per process (and again if it changes), not once per plane
+    """
+    path, page, channel, level = job
+    first = _open_stack(path, channel, level, os.stat(path).st_mtime_ns)
+    return first.plane(page)[()]
+
+
+class StackReader:
+    def __init__(self, path, channel=None, level=0, threads: int = 1):
+        """
+        Streams the planes (flat index over any Z/T/I axes) of a TIFF one at a time
+        channel: read only this channel of every plane
+        threads > 1 reads and decodes the next planes on a thread pool; at most
+        2 * threads planes are read ahead, so memory stays at a few planes
+        The file is opened once; planes are read from its memory map or zarr
+        store. Compressed stacks are only read plane by plane if zarr is
+        installed, otherwise they are decoded once in full
+        """
+        first = TiffImage(path, channel=channel, level=level)
+        self._first = first
+        self.path = path
+        self.channel = channel
+        self.level = level
+        self.threads = threads
+        self.shape = first.shape  # of one plane
+        self.dtype = first.dtype
+        self.pages = first.pages
+
+    def __len__(self):
+        return self.pages
+
+    def __getitem__(self, page):
+        return self._first.plane(page)[()]
+
+    def __iter__(self):
+        pages = range(self.pages)
+        if self.threads <= 1:
+            yield from map(self.__getitem__, pages)
+            return
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            yield from imap_bounded(self.__getitem__, pages, executor, 2 * self.threads)
+
+
+def project(planes, mode="max"):
+    """
+    input: iterable of equally shaped planes, e.g. a StackReader
+    Returns max (input dtype) or mean (float32) intensity projection, folded
+    in one plane at a time so only the running result is kept
+    """
+    if mode not in PROJECTIONS:
+        raise ValueError(f"Unknown projection: {mode}")
+
+    acc = None
+    n = 0
+    for plane in planes:
+        if acc is None:
+            acc = plane.astype(np.float64 if mode == "mean" else plane.dtype, copy=True)
+        elif plane.shape != acc.shape:
+            raise ValueError(f"Plane shape {plane.shape} differs from {acc.shape}")
+        elif mode == "max":
+            np.maximum(acc, plane, out=acc)
+        else:
+            acc += plane
+        n += 1
+
+    if acc is None:
+        raise ValueError("Stack has no planes")
+    if mode == "mean":
+        acc = (acc / n).astype(np.float32)
+    return acc
+
+
+def _count_plane(job):
+    """
+    Worker: reads one plane and counts its cells
+    Returns (page, count, otsu_value)
+    """
+    analysis = CellCount(read_plane(job["plane"]), job["peak_thresh_frac"], job["min_area"])
+    count, _, debug = analysis.run(outputs=(), **job["run_args"])
+    return job["plane"][1], count, float(debug["otsu_value"])
+
+
+def count_planes(path,
+                 peak_thresh_frac,
+                 min_area,
+                 channel: int = 2,
+                 level: int = 0,
+                 processes: int = 1,
+                 **run_args):
+    """
+    Counts cells in every plane of a stack separately
+    Yields (page, count, otsu_value) in plane order as planes finish. Each
+    worker reads its own plane and only the nuclei channel, and at most
+    2 * processes planes are in flight; None uses one process per core
+    run_args are passed to CellCount.run (max_area, blur_ksize, ...)
+    """
+    stack = StackReader(path, level=level)
+    # Planes are read as the nuclei channel only, then counted as grayscale
+    plane_channel = channel if len(stack.shape) == 3 else None
+
+    jobs = ({"plane": (path, page, plane_channel, level),
+             "peak_thresh_frac": peak_thresh_frac,
+             "min_area": min_area,
+             "run_args": run_args}
+            for page in range(stack.pages))
+
+    processes = processes or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=processes) if processes > 1 else None
+    try:
+        yield from imap_bounded(_count_plane, jobs, executor, 2 * processes)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)